@@ -2,84 +2,290 @@
 Dr. Inker LABS - BERT Chart Scanner
 All Telegram bot handlers. No polling — webhook mode via web_server.py
 """
+import asyncio
 import logging
 import io
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from telegram import (
     Update, InlineKeyboardButton, InlineKeyboardMarkup,
-    LabeledPrice, WebAppInfo
+    LabeledPrice, WebAppInfo, InputFile
 )
+from telegram.constants import MessageLimit
+from telegram.error import TimedOut
 from telegram.ext import ContextTypes
 from config import (
     WEBAPP_URL, BOT_NAME, BRAND,
     FREE_DAILY_SCANS, ENERGY_REFILL_STARS, PREMIUM_STARS_MONTHLY,
-    REFERRAL_BONUS_SCANS
+    REFERRAL_BONUS_SCANS, MAX_IMAGE_BYTES
 )
 from database import (
     get_or_create_user, get_energy_status, use_scan,
-    add_bonus_scans, set_premium, save_scan, get_scan_history,
+    add_bonus_scans, set_premium, save_scans, get_scan_history,
     process_referral, get_referral_count, get_leaderboard
 )
 from gemini_analyzer import analyze_chart, format_analysis_text, format_detailed_analysis
 from dexscreener import enrich_analysis, format_enrichment_text
-from report_card import generate_report_card
+from report_card import generate_report_card, init_worker
 
 logger = logging.getLogger(__name__)
 
+# Strong refs to in-flight scan tasks so they aren't garbage-collected mid-run
+_BG_TASKS = set()
+
+
+def _run_in_background(coro):
+    """Schedule a coroutine without blocking the handler that spawned it."""
+    task = asyncio.create_task(coro)
+    _BG_TASKS.add(task)
+    task.add_done_callback(_BG_TASKS.discard)
+    return task
+
+
+async def drain_background_tasks(timeout: float = 25.0):
+    """Wait for in-flight scans (and the flushes they queue) at shutdown; cancel stragglers.
+
+    These tasks aren't Application.create_task tasks, so Application.stop() doesn't wait for them.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    # Finishing scans can schedule new flush tasks, so re-check until the set stays empty
+    while _BG_TASKS and loop.time() < deadline:
+        await asyncio.wait(set(_BG_TASKS), timeout=deadline - loop.time())
+    pending = set(_BG_TASKS)
+    if pending:
+        logger.warning("Cancelling %d background tasks still running at shutdown", len(pending))
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+# Scan history isn't read back right away, so rows are buffered and written in one
+# transaction per batch instead of one commit per scan. Only touched on the loop thread.
+SCAN_FLUSH_INTERVAL = 0.5
+SCAN_FLUSH_MAX = 100
+_pending_scans = []
+_scan_flush_timer = None
+
+
+def _queue_scan_save(user_id: int, analysis: dict, file_id: str):
+    global _scan_flush_timer
+    _pending_scans.append((user_id, analysis, file_id))
+    if len(_pending_scans) >= SCAN_FLUSH_MAX:
+        _run_in_background(flush_pending_scans())
+    elif _scan_flush_timer is None:
+        _scan_flush_timer = asyncio.get_running_loop().call_later(
+            SCAN_FLUSH_INTERVAL, lambda: _run_in_background(flush_pending_scans())
+        )
 
-# ═══════════════════════════════════════════
-# COMMAND HANDLERS
-# ═══════════════════════════════════════════
 
-async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
-    db_user = get_or_create_user(user.id, user.username, user.first_name)
+async def flush_pending_scans():
+    """Write every buffered scan now. Also called on shutdown."""
+    global _scan_flush_timer
+    if _scan_flush_timer is not None:
+        _scan_flush_timer.cancel()
+        _scan_flush_timer = None
+    if not _pending_scans:
+        return
+    batch = _pending_scans[:]
+    _pending_scans.clear()
+    try:
+        await asyncio.to_thread(save_scans, batch)
+    except Exception:
+        logger.exception("Saving %d scans failed", len(batch))
+
+
+# Short-lived per-user energy snapshots — absorbs bursts of button taps
+ENERGY_CACHE_TTL = 2.0
+ENERGY_CACHE_SIZE = 10_000
+_energy_cache: "OrderedDict[int, tuple]" = OrderedDict()
+
+
+async def _cached_energy(user_id: int) -> dict:
+    now = time.monotonic()
+    cached = _energy_cache.get(user_id)
+    if cached and now - cached[0] < ENERGY_CACHE_TTL:
+        return cached[1]
+    energy = await asyncio.to_thread(get_energy_status, user_id)
+    now = time.monotonic()
+    _energy_cache[user_id] = (now, energy)
+    _energy_cache.move_to_end(user_id)
+    # Oldest snapshots sit at the front — shed the expired ones and cap the rest
+    while _energy_cache:
+        stamp = next(iter(_energy_cache.values()))[0]
+        if now - stamp < ENERGY_CACHE_TTL and len(_energy_cache) <= ENERGY_CACHE_SIZE:
+            break
+        _energy_cache.popitem(last=False)
+    return energy
+
+
+def _invalidate_energy(user_id: int):
+    """Drop the cached snapshot after anything that changes a user's scans."""
+    _energy_cache.pop(user_id, None)
+
+
+# One scan per user at a time, plus a short debounce against photo spam
+SCAN_DEBOUNCE_SECONDS = 0.5
+_inflight_scans = set()
+_last_scan_at: "OrderedDict[int, float]" = OrderedDict()
+
+
+def _claim_scan_slot(user_id: int) -> bool:
+    """Reserve the user's scan slot. False if a scan is running or one just started."""
+    now = time.monotonic()
+    # Start times are kept oldest-first; anything past the window no longer matters
+    while _last_scan_at and now - next(iter(_last_scan_at.values())) >= SCAN_DEBOUNCE_SECONDS:
+        _last_scan_at.popitem(last=False)
+    if user_id in _inflight_scans or user_id in _last_scan_at:
+        return False
+    _inflight_scans.add(user_id)
+    _last_scan_at[user_id] = now
+    return True
+
+
+def _release_scan_slot(user_id: int):
+    _inflight_scans.discard(user_id)
+
+
+# Each user's most recent scan, for the Detailed Analysis / Share buttons.
+# Bounded LRU with a TTL instead of user_data so memory has a fixed ceiling
+# and stale scans don't pin card bytes for users who never come back.
+LAST_SCAN_CACHE_SIZE = 5000
+LAST_SCAN_TTL = 600.0
+_last_scans = OrderedDict()
+
+
+def _remember_scan(user_id: int, analysis: dict, dex_data: dict | None, card_file_id: str | None):
+    _last_scans[user_id] = {"analysis": analysis, "dex_data": dex_data, "card_file_id": card_file_id,
+                            "at": time.monotonic()}
+    _last_scans.move_to_end(user_id)
+    while len(_last_scans) > LAST_SCAN_CACHE_SIZE:
+        _last_scans.popitem(last=False)
+
+
+def _recall_scan(user_id: int) -> dict | None:
+    scan = _last_scans.get(user_id)
+    if scan is None:
+        return None
+    if time.monotonic() - scan["at"] > LAST_SCAN_TTL:
+        del _last_scans[user_id]
+        return None
+    _last_scans.move_to_end(user_id)
+    return scan
+
+
+async def _reply_card(message, card_bytes: bytes, caption: str):
+    # InputFile keeps raw bytes as-is — wrapping them in BytesIO first only adds a read() copy
+    ext = (_sniff_image_mime(card_bytes) or "image/png").split("/")[1]
+    photo = InputFile(card_bytes, filename=f"bert_card.{ext}")
+    return await message.reply_photo(photo=photo, caption=caption, parse_mode="HTML")
+
+
+def _sniff_image_mime(data: bytes) -> str | None:
+    """MIME type from the file's magic bytes — the client-declared type isn't trusted. None if not an image."""
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+# Card rendering is pure CPU (Pillow + image encode) — run it in worker processes.
+# The web server's lifespan starts and stops the pool. Workers come from a
+# forkserver (spawn where that's missing): forking this threaded process could
+# copy a lock some other thread holds.
+_card_pool = None
+
+
+def _new_card_pool() -> ProcessPoolExecutor:
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(
+        max_workers=max(2, (os.cpu_count() or 2) // 2),
+        mp_context=multiprocessing.get_context(method), initializer=init_worker)
+
+
+def start_card_pool():
+    global _card_pool
+    if _card_pool is None:
+        _card_pool = _new_card_pool()
 
-    if context.args:
-        ref_code = context.args[0]
-        if process_referral(ref_code, user.id):
-            await update.message.reply_text(
-                "🎁 Referral bonus! You got <b>3 free scans</b>!", parse_mode="HTML"
-            )
 
-    energy = get_energy_status(user.id)
+def shutdown_card_pool():
+    global _card_pool
+    pool, _card_pool = _card_pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
 
-    keyboard = [
-        [InlineKeyboardButton("📊 How to Scan", callback_data="help_scan")],
-        [
-            InlineKeyboardButton("⚡ My Energy", callback_data="energy"),
-            InlineKeyboardButton("📈 History", web_app=WebAppInfo(url=f"{WEBAPP_URL}/app?user_id={user.id}"))
-        ],
-        [
-            InlineKeyboardButton("🔗 Refer Friends", callback_data="referral"),
-            InlineKeyboardButton("👑 Go Premium", callback_data="premium")
-        ],
-        [InlineKeyboardButton("🏆 Leaderboard", callback_data="leaderboard")],
-    ]
-
-    await update.message.reply_text(
-        f"""
-🔬 <b>Welcome to {BOT_NAME}!</b>
 
-📸 Send me any chart screenshot and I'll instantly analyze it using AI:
-
-✅ Trend direction & strength
-✅ Support & resistance levels
-✅ Chart patterns detected
-✅ Risk assessment
-✅ Buy/Sell/Hold verdict
+async def _render_card(analysis: dict, dex_data: dict | None) -> bytes:
+    global _card_pool
+    pool = _card_pool
+    # Only the lifespan starts the pool — a render after shutdown must not bring it back
+    if pool is None:
+        raise RuntimeError("Card render pool is not running")
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(pool, generate_report_card, analysis, dex_data)
+    except BrokenProcessPool:
+        # A dead worker (OOM kill, crash) breaks the executor for good — replace it once
+        logger.warning("Card render pool broke; restarting it")
+        if _card_pool is pool:
+            _card_pool = _new_card_pool()
+            pool.shutdown(wait=False, cancel_futures=True)
+        if _card_pool is None:
+            raise
+        return await loop.run_in_executor(_card_pool, generate_report_card, analysis, dex_data)
+
+
+# Leaderboard is identical for every user and changes slowly
+LEADERBOARD_CACHE_TTL = 30.0
+_leaderboard_cache = {"t": 0.0, "v": None, "text": {}}
+
+
+async def _cached_leaderboard(limit: int = 10) -> list:
+    now = time.monotonic()
+    if _leaderboard_cache["v"] is not None and now - _leaderboard_cache["t"] < LEADERBOARD_CACHE_TTL:
+        return _leaderboard_cache["v"]
+    leaders = await asyncio.to_thread(get_leaderboard, limit)
+    _leaderboard_cache.update(t=now, v=leaders, text={})
+    return leaders
+
+
+async def _leaderboard_text(compact: bool) -> str | None:
+    """Formatted leaderboard (compact for the inline button), cached alongside the rows. None if empty."""
+    leaders = await _cached_leaderboard(10)
+    if not leaders:
+        return None
+    texts = _leaderboard_cache["text"]
+    if compact not in texts:
+        if compact:
+            parts = ["🏆 <b>Top Scanners</b>\n\n"]
+            for i, u in enumerate(leaders):
+                medal = _MEDALS[i] if i < 3 else f"{i+1}."
+                name = u["first_name"] or u["username"] or "Anon"
+                parts.append(f"{medal} {name} — {u['total_scans']} scans\n")
+        else:
+            parts = ["🏆 <b>Top Chart Scanners</b>\n━━━━━━━━━━━━━━━━\n\n"]
+            for i, u in enumerate(leaders):
+                medal = _MEDALS[i] if i < 3 else f"{i+1}."
+                name = u["first_name"] or u["username"] or "Anonymous"
+                parts.append(f"{medal} <b>{name}</b> — {u['total_scans']} scans\n")
+            parts.append(f"\n<i>Scan more charts to climb the ranks!</i>\n🔬 <i>{BRAND}</i>")
+        texts[compact] = "".join(parts)
+    return texts[compact]
 
-⚡ You have <b>{energy['total_remaining']}</b> scans remaining today.
-
-Just send a screenshot to get started! 👇
-""",
-        parse_mode="HTML",
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
 
+# ═══════════════════════════════════════════
+# STATIC MESSAGES & KEYBOARDS (built once at import)
+# ═══════════════════════════════════════════
 
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        f"""
+_HELP_TEXT = f"""
 🔬 <b>{BOT_NAME} - Help</b>
 
 <b>How to use:</b>
@@ -105,61 +311,252 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 👑 Premium gets <b>unlimited scans</b>
 
 <i>Powered by {BRAND}</i>
-""",
-        parse_mode="HTML"
-    )
+"""
 
+# Templates: config values are baked in at import, per-user fields filled with format_map
+_WELCOME_TPL = f"""
+🔬 <b>Welcome to {BOT_NAME}!</b>
 
-async def scan_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
-    get_or_create_user(user.id, user.username, user.first_name)
-    energy = get_energy_status(user.id)
+📸 Send me any chart screenshot and I'll instantly analyze it using AI:
 
-    if energy["is_premium"]:
-        status = "👑 <b>PREMIUM</b> - Unlimited scans!"
-    else:
-        bar_free = "🟢" * energy["free_remaining"] + "⚫" * (FREE_DAILY_SCANS - energy["free_remaining"])
-        status = f"""
-⚡ Daily Scans: {bar_free} ({energy['free_remaining']}/{FREE_DAILY_SCANS})
-🎁 Bonus Scans: {energy['bonus_scans']}
-📊 Total Available: <b>{energy['total_remaining']}</b>
-"""
+✅ Trend direction & strength
+✅ Support & resistance levels
+✅ Chart patterns detected
+✅ Risk assessment
+✅ Buy/Sell/Hold verdict
 
-    keyboard = [
-        [InlineKeyboardButton(f"⚡ Buy {ENERGY_REFILL_STARS} Scans ({ENERGY_REFILL_STARS} ⭐)", callback_data="buy_scans")],
-        [InlineKeyboardButton("👑 Go Premium (Unlimited)", callback_data="premium")],
-        [InlineKeyboardButton("🔗 Refer for Free Scans", callback_data="referral")],
-    ]
+⚡ You have <b>{{total_remaining}}</b> scans remaining today.
 
-    await update.message.reply_text(
-        f"""
+Just send a screenshot to get started! 👇
+"""
+
+_SCAN_STATUS_TPL = """
 🔬 <b>Scan Energy Status</b>
 ━━━━━━━━━━━━━━━━
 {status}
-📈 Total scans ever: {energy['total_scans_ever']}
+📈 Total scans ever: {total_scans_ever}
 ━━━━━━━━━━━━━━━━
-""",
+"""
+
+_SCAN_PREMIUM_STATUS = "👑 <b>PREMIUM</b> - Unlimited scans!"
+
+_SCAN_FREE_STATUS_TPL = f"""
+⚡ Daily Scans: {{bar}} ({{free_remaining}}/{FREE_DAILY_SCANS})
+🎁 Bonus Scans: {{bonus_scans}}
+📊 Total Available: <b>{{total_remaining}}</b>
+"""
+
+_REFER_TPL = f"""
+🔗 <b>Your Referral Link</b>
+━━━━━━━━━━━━━━━━
+
+Share this link with friends:
+<code>{{ref_link}}</code>
+
+✅ You get <b>{REFERRAL_BONUS_SCANS} free scans</b> per referral
+✅ They get <b>3 bonus scans</b> to start
+
+👥 Friends referred: <b>{{ref_count}}</b>
+🎁 Total bonus earned: <b>{{bonus_earned}} scans</b>
+━━━━━━━━━━━━━━━━
+"""
+
+_TEXT_FALLBACK = (
+    "📸 <b>Send me a chart screenshot!</b>\n\n"
+    "I analyze images, not text. Take a screenshot of any chart "
+    "(DexScreener, TradingView, Birdeye, etc.) and send it here.\n\n"
+    "Type /help for more info."
+)
+
+_SCAN_BUSY_TEXT = "⏳ Still analyzing your last chart — hang tight!"
+
+_BAD_IMAGE_TEXT = (
+    "❌ <b>That file doesn't look like a chart screenshot</b>\n\n"
+    f"Send a JPEG, PNG or WebP image under {MAX_IMAGE_BYTES // (1024 * 1024)} MB.\n\n"
+    "Your scan energy was <b>not consumed</b>."
+)
+
+_ANALYZING_TEXT = (
+    "🔬 <b>Analyzing your chart...</b>\n\n"
+    "🧠 AI is reading the chart...\n"
+    "📊 Detecting patterns...\n"
+    "⏳ This usually takes 5-10 seconds..."
+)
+
+_HELP_SCAN_TEXT = (
+    "📸 <b>Just send me a chart screenshot!</b>\n\n"
+    "I support charts from:\n"
+    "• DexScreener\n• TradingView\n• Birdeye\n• CoinGecko\n• Any other charting platform\n\n"
+    "📱 Screenshot → Send → Get Analysis!"
+)
+
+_PREMIUM_TEXT = (
+    f"👑 <b>Premium Plan</b>\n\n"
+    f"✅ <b>Unlimited</b> chart scans\n"
+    f"✅ Detailed analysis on every scan\n"
+    f"✅ Priority AI processing\n"
+    f"✅ Full scan history & analytics\n"
+    f"✅ Shareable report cards\n\n"
+    f"💰 Only <b>{PREMIUM_STARS_MONTHLY} Telegram Stars/month</b>"
+)
+
+_PREMIUM_KEYBOARD = InlineKeyboardMarkup([[
+    InlineKeyboardButton(f"👑 Subscribe ({PREMIUM_STARS_MONTHLY} ⭐/month)", callback_data="pay_premium")
+]])
+
+_BUY_SCANS_TEXT = (
+    f"⚡ <b>Refill Scans</b>\n\nGet <b>{ENERGY_REFILL_STARS} extra scans</b> "
+    f"for {ENERGY_REFILL_STARS} Telegram Stars.\nThese bonus scans don't expire!"
+)
+
+_BUY_SCANS_KEYBOARD = InlineKeyboardMarkup([[
+    InlineKeyboardButton(f"⚡ Buy {ENERGY_REFILL_STARS} Scans ({ENERGY_REFILL_STARS} ⭐)", callback_data="pay_scans")
+]])
+
+# Markups are immutable in PTB, so one instance is shared by every reply that uses it
+_BUY_SCANS_ROW = [
+    InlineKeyboardButton(f"⚡ Buy {ENERGY_REFILL_STARS} Scans ({ENERGY_REFILL_STARS} ⭐)", callback_data="buy_scans")
+]
+_REFER_FOR_SCANS_ROW = [InlineKeyboardButton("🔗 Refer for Free Scans", callback_data="referral")]
+
+_SCAN_KEYBOARD = InlineKeyboardMarkup([
+    _BUY_SCANS_ROW,
+    [InlineKeyboardButton("👑 Go Premium (Unlimited)", callback_data="premium")],
+    _REFER_FOR_SCANS_ROW,
+])
+
+# Used by both the photo and the image-document handlers
+_OUT_OF_SCANS_KEYBOARD = InlineKeyboardMarkup([
+    _BUY_SCANS_ROW,
+    [InlineKeyboardButton("👑 Go Premium", callback_data="premium")],
+    _REFER_FOR_SCANS_ROW,
+])
+
+_TREND_EMOJI = {"Bullish": "🟢", "Bearish": "🔴", "Sideways": "🟡"}
+_ACTION_EMOJI = {"BUY": "🟢", "SELL": "🔴", "HOLD": "🟡", "WAIT": "⏳"}
+_MEDALS = ("🥇", "🥈", "🥉")
+
+# Every possible daily-scan bar, indexed by free scans remaining
+_ENERGY_BARS = tuple("🟢" * i + "⚫" * (FREE_DAILY_SCANS - i) for i in range(FREE_DAILY_SCANS + 1))
+
+# Start menu rows that don't depend on the user; the History web-app button is per-user
+_START_HELP_ROW = [InlineKeyboardButton("📊 How to Scan", callback_data="help_scan")]
+_START_ENERGY_BUTTON = InlineKeyboardButton("⚡ My Energy", callback_data="energy")
+_START_REFER_ROW = [
+    InlineKeyboardButton("🔗 Refer Friends", callback_data="referral"),
+    InlineKeyboardButton("👑 Go Premium", callback_data="premium")
+]
+_START_LEADERBOARD_ROW = [InlineKeyboardButton("🏆 Leaderboard", callback_data="leaderboard")]
+
+
+# ═══════════════════════════════════════════
+# USER TRACKING
+# ═══════════════════════════════════════════
+
+# Users already upserted by this process: user_id -> (referral code, username,
+# first_name as last written). Bounded LRU — skips the DB on every later update
+# without growing forever, but a rename is still written through.
+USER_CACHE_SIZE = 10_000
+_known_users = OrderedDict()
+
+
+async def _remember_user(user) -> str:
+    """Upsert the user when new to this process or renamed; return their referral code."""
+    known = _known_users.get(user.id)
+    if known is None or known[1:] != (user.username, user.first_name):
+        db_user = await asyncio.to_thread(get_or_create_user, user.id, user.username, user.first_name)
+        _known_users[user.id] = (db_user["referral_code"], user.username, user.first_name)
+        while len(_known_users) > USER_CACHE_SIZE:
+            _known_users.popitem(last=False)
+    else:
+        _known_users.move_to_end(user.id)
+    return _known_users[user.id][0]
+
+
+async def ensure_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Runs ahead of every other handler (group -1) so the user row always exists."""
+    user = update.effective_user
+    if user is not None:
+        await _remember_user(user)
+
+
+# ═══════════════════════════════════════════
+# COMMAND HANDLERS
+# ═══════════════════════════════════════════
+
+async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+
+    if context.args:
+        ref_code = context.args[0]
+        if await asyncio.to_thread(process_referral, ref_code, user.id):
+            _invalidate_energy(user.id)
+            await update.message.reply_text(
+                "🎁 Referral bonus! You got <b>3 free scans</b>!", parse_mode="HTML"
+            )
+
+    energy = await _cached_energy(user.id)
+
+    keyboard = [
+        _START_HELP_ROW,
+        [
+            _START_ENERGY_BUTTON,
+            InlineKeyboardButton("📈 History", web_app=WebAppInfo(url=f"{WEBAPP_URL}/app?user_id={user.id}"))
+        ],
+        _START_REFER_ROW,
+        _START_LEADERBOARD_ROW,
+    ]
+
+    await update.message.reply_text(
+        _WELCOME_TPL.format_map({"total_remaining": energy["total_remaining"]}),
         parse_mode="HTML",
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
 
 
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(_HELP_TEXT, parse_mode="HTML")
+
+
+async def scan_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    energy = await _cached_energy(user.id)
+
+    if energy["is_premium"]:
+        status = _SCAN_PREMIUM_STATUS
+    else:
+        status = _SCAN_FREE_STATUS_TPL.format_map({
+            "bar": _ENERGY_BARS[energy["free_remaining"]],
+            "free_remaining": energy["free_remaining"],
+            "bonus_scans": energy["bonus_scans"],
+            "total_remaining": energy["total_remaining"],
+        })
+
+    await update.message.reply_text(
+        _SCAN_STATUS_TPL.format_map({"status": status, "total_scans_ever": energy["total_scans_ever"]}),
+        parse_mode="HTML",
+        reply_markup=_SCAN_KEYBOARD
+    )
+
+
 async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    get_or_create_user(user.id, user.username, user.first_name)
-    scans = get_scan_history(user.id, limit=5)
+    scans = await asyncio.to_thread(get_scan_history, user.id, limit=5)
 
     if not scans:
         await update.message.reply_text("📭 No scans yet! Send me a chart screenshot to get started.")
         return
 
-    msg = "📜 <b>Recent Scans</b>\n━━━━━━━━━━━━━━━━\n\n"
+    parts = ["📜 <b>Recent Scans</b>\n━━━━━━━━━━━━━━━━\n\n"]
     for i, scan in enumerate(scans, 1):
-        trend_emoji = {"Bullish": "🟢", "Bearish": "🔴", "Sideways": "🟡"}.get(scan["trend"], "⚪")
-        action_emoji = {"BUY": "🟢", "SELL": "🔴", "HOLD": "🟡", "WAIT": "⏳"}.get(scan["action"], "⚪")
-        msg += f"{i}. {trend_emoji} <b>{scan['token'] or 'Unknown'}</b> ({scan['ticker'] or '?'})\n"
-        msg += f"   {action_emoji} {scan['action']} | Risk: {scan['risk_level']} | Conf: {scan['confidence']}/10\n"
-        msg += f"   📅 {scan['created_at'][:16]}\n\n"
+        trend_emoji = _TREND_EMOJI.get(scan["trend"], "⚪")
+        action_emoji = _ACTION_EMOJI.get(scan["action"], "⚪")
+        parts.append(
+            f"{i}. {trend_emoji} <b>{scan['token'] or 'Unknown'}</b> ({scan['ticker'] or '?'})\n"
+            f"   {action_emoji} {scan['action']} | Risk: {scan['risk_level']} | Conf: {scan['confidence']}/10\n"
+            f"   📅 {scan['created_at'][:16]}\n\n"
+        )
+    parts.append("<i>Open the dashboard for full history & analytics</i>")
 
     keyboard = [[
         InlineKeyboardButton(
@@ -169,7 +566,7 @@ async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ]]
 
     await update.message.reply_text(
-        msg + "<i>Open the dashboard for full history & analytics</i>",
+        "".join(parts),
         parse_mode="HTML",
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
@@ -177,155 +574,187 @@ async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def refer_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    db_user = get_or_create_user(user.id, user.username, user.first_name)
-    ref_count = get_referral_count(user.id)
+    referral_code = await _remember_user(user)
+    ref_count = await asyncio.to_thread(get_referral_count, user.id)
 
-    bot_info = await context.bot.get_me()
-    ref_link = f"https://t.me/{bot_info.username}?start={db_user['referral_code']}"
+    # Filled in by Application.initialize() (get_me) — no API call here
+    ref_link = f"https://t.me/{context.bot.username}?start={referral_code}"
 
     await update.message.reply_text(
-        f"""
-🔗 <b>Your Referral Link</b>
-━━━━━━━━━━━━━━━━
-
-Share this link with friends:
-<code>{ref_link}</code>
-
-✅ You get <b>{REFERRAL_BONUS_SCANS} free scans</b> per referral
-✅ They get <b>3 bonus scans</b> to start
-
-👥 Friends referred: <b>{ref_count}</b>
-🎁 Total bonus earned: <b>{ref_count * REFERRAL_BONUS_SCANS} scans</b>
-━━━━━━━━━━━━━━━━
-""",
+        _REFER_TPL.format_map({
+            "ref_link": ref_link,
+            "ref_count": ref_count,
+            "bonus_earned": ref_count * REFERRAL_BONUS_SCANS,
+        }),
         parse_mode="HTML"
     )
 
 
+async def _send_premium_pitch(reply):
+    """Shared by /premium and the Go Premium button; `reply` is a bound reply_text."""
+    await reply(_PREMIUM_TEXT, parse_mode="HTML", reply_markup=_PREMIUM_KEYBOARD)
+
+
 async def premium_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    keyboard = [[
-        InlineKeyboardButton(
-            f"👑 Subscribe ({PREMIUM_STARS_MONTHLY} ⭐/month)",
-            callback_data="pay_premium"
-        )
-    ]]
-    await update.message.reply_text(
-        f"👑 <b>Premium Plan</b>\n\n"
-        f"✅ <b>Unlimited</b> chart scans\n"
-        f"✅ Detailed analysis on every scan\n"
-        f"✅ Priority AI processing\n"
-        f"✅ Full scan history & analytics\n"
-        f"✅ Shareable report cards\n\n"
-        f"💰 Only <b>{PREMIUM_STARS_MONTHLY} Telegram Stars/month</b>",
-        parse_mode="HTML",
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
+    await _send_premium_pitch(update.message.reply_text)
 
 
 async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    leaders = get_leaderboard(10)
-    if not leaders:
+    text = await _leaderboard_text(compact=False)
+    if text is None:
         await update.message.reply_text("🏆 No scans yet! Be the first!")
         return
-    msg = "🏆 <b>Top Chart Scanners</b>\n━━━━━━━━━━━━━━━━\n\n"
-    medals = ["🥇", "🥈", "🥉"]
-    for i, user in enumerate(leaders):
-        medal = medals[i] if i < 3 else f"{i+1}."
-        name = user["first_name"] or user["username"] or "Anonymous"
-        msg += f"{medal} <b>{name}</b> — {user['total_scans']} scans\n"
-    await update.message.reply_text(
-        msg + f"\n<i>Scan more charts to climb the ranks!</i>\n🔬 <i>{BRAND}</i>",
-        parse_mode="HTML"
-    )
+    await update.message.reply_text(text, parse_mode="HTML")
 
 
 # ═══════════════════════════════════════════
 # IMAGE HANDLER (Core Feature)
 # ═══════════════════════════════════════════
 
-async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+def _start_card_render(analysis: dict, dex_data: dict | None = None, draft=None) -> asyncio.Future:
+    """
+    Kick off a card render. Scans start a draft without live data while DexScreener
+    is queried; the draft is only thrown away if the lookup actually finds the token.
+    """
+    if draft is not None:
+        if not (dex_data and dex_data.get("found")):
+            return draft
+        if draft.done():
+            # A failed draft nobody awaits would log "Task exception was never retrieved"
+            if not draft.cancelled() and draft.exception() is not None:
+                logger.warning("Draft card render failed: %s", draft.exception())
+        else:
+            draft.cancel()
+    return asyncio.ensure_future(_render_card(analysis, dex_data))
+
+
+async def _send_scan_follow_ups(message, dex_data: dict | None, card_task: asyncio.Future,
+                                caption: str) -> str | None:
+    """Send the DexScreener summary and report card after the main analysis. Returns the card's file_id."""
+    dex_text = format_enrichment_text(dex_data) if dex_data else ""
+
+    card_bytes = None
+    try:
+        card_bytes = await card_task
+    except Exception:
+        logger.exception("Report card generation failed")
+
+    follow_ups = []
+    if card_bytes is not None:
+        # Fold the live data into the card caption when it fits — one message instead of two
+        if dex_text and len(dex_text) + 2 + len(caption) <= MessageLimit.CAPTION_LENGTH:
+            caption, dex_text = f"{dex_text}\n\n{caption}", ""
+        follow_ups.append(_reply_card(message, card_bytes, caption))
+    if dex_text:
+        follow_ups.insert(0, message.reply_text(dex_text, parse_mode="HTML", disable_web_page_preview=True))
+
+    card_file_id = None
+    for result in await asyncio.gather(*follow_ups, return_exceptions=True):
+        if isinstance(result, Exception):
+            logger.error("Sending scan follow-up failed: %s", result)
+        elif result.photo:
+            card_file_id = result.photo[-1].file_id
+    return card_file_id
+
+
+async def _run_scan(update: Update, context: ContextTypes.DEFAULT_TYPE, file_id: str):
+    """Shared front half of the photo and image-document handlers: gate, placeholder, hand off."""
     user = update.effective_user
-    get_or_create_user(user.id, user.username, user.first_name)
 
-    energy = get_energy_status(user.id)
+    energy = await _cached_energy(user.id)
     if energy["total_remaining"] <= 0:
-        keyboard = [
-            [InlineKeyboardButton(f"⚡ Buy {ENERGY_REFILL_STARS} Scans ({ENERGY_REFILL_STARS} ⭐)", callback_data="buy_scans")],
-            [InlineKeyboardButton("👑 Go Premium", callback_data="premium")],
-            [InlineKeyboardButton("🔗 Refer for Free Scans", callback_data="referral")],
-        ]
         await update.message.reply_text(
             "⚡ <b>Out of scans!</b>\n\nRefill your energy to keep scanning charts.",
-            parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard)
+            parse_mode="HTML", reply_markup=_OUT_OF_SCANS_KEYBOARD
         )
         return
 
-    analyzing_msg = await update.message.reply_text(
-        "🔬 <b>Analyzing your chart...</b>\n\n"
-        "🧠 AI is reading the chart...\n"
-        "📊 Detecting patterns...\n"
-        "⏳ This usually takes 5-10 seconds...",
-        parse_mode="HTML"
-    )
+    if not _claim_scan_slot(user.id):
+        await update.message.reply_text(_SCAN_BUSY_TEXT)
+        return
 
     try:
-        photo = update.message.photo[-1]
-        file = await context.bot.get_file(photo.file_id)
-        image_data = await file.download_as_bytearray()
+        analyzing_msg = await update.message.reply_text(_ANALYZING_TEXT, parse_mode="HTML")
+    except Exception:
+        _release_scan_slot(user.id)
+        raise
 
-        analysis = analyze_chart(bytes(image_data), "image/jpeg")
+    task = _run_in_background(_process_scan(update, context, analyzing_msg, file_id))
+    task.add_done_callback(lambda _: _release_scan_slot(user.id))
 
-        if analysis.get("success"):
-            use_scan(user.id)
 
-            await analyzing_msg.edit_text(
-                "🔬 <b>Analyzing your chart...</b>\n\n"
-                "✅ AI analysis complete!\n"
-                "📡 Fetching live data from DexScreener...\n"
-                "🎨 Generating report card...",
-                parse_mode="HTML"
-            )
+# Gemini reads chart patterns fine at ~1024px — no need to pull the full-size original
+SCAN_PHOTO_MIN_WIDTH = 1024
+
+
+async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Sizes arrive smallest first; take the first one wide enough, else the largest
+    sizes = update.message.photo
+    photo = next((p for p in sizes if p.width >= SCAN_PHOTO_MIN_WIDTH), sizes[-1])
+    await _run_scan(update, context, photo.file_id)
+
+
+async def handle_document_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # filters.Document.IMAGE only checks the declared type; _process_scan sniffs the real one
+    await _run_scan(update, context, update.message.document.file_id)
+
+
+async def _process_scan(update: Update, context: ContextTypes.DEFAULT_TYPE, analyzing_msg,
+                        file_id: str):
+    """Heavy half of _run_scan: download, analyze, enrich, reply."""
+    user = update.effective_user
+    try:
+        file = await context.bot.get_file(file_id)
+        if file.file_size and file.file_size > MAX_IMAGE_BYTES:
+            await analyzing_msg.edit_text(_BAD_IMAGE_TEXT, parse_mode="HTML")
+            return
+        buf = io.BytesIO()
+        await file.download_to_memory(buf)
+        image_data = buf.getvalue()
+
+        # Reject non-images before spending Gemini quota on them
+        mime_type = _sniff_image_mime(image_data)
+        if mime_type is None or len(image_data) > MAX_IMAGE_BYTES:
+            await analyzing_msg.edit_text(_BAD_IMAGE_TEXT, parse_mode="HTML")
+            return
+
+        analysis = await analyze_chart(image_data, mime_type)
 
+        if analysis.get("success"):
+            await asyncio.to_thread(use_scan, user.id)
+            _invalidate_energy(user.id)
+
+            # DexScreener lookup, DB write and card render are independent — overlap them
+            card_task = _start_card_render(analysis)
+            _queue_scan_save(user.id, analysis, file_id)
             dex_data = await enrich_analysis(analysis)
-            save_scan(user.id, analysis, photo.file_id)
-            new_energy = get_energy_status(user.id)
+            card_task = _start_card_render(analysis, dex_data, draft=card_task)
+            new_energy = await _cached_energy(user.id)
             main_text = format_analysis_text(analysis)
 
-            await analyzing_msg.delete()
-
             keyboard = [
-                [InlineKeyboardButton("📝 Detailed Analysis", callback_data=f"detail_{user.id}")],
+                [InlineKeyboardButton("📝 Detailed Analysis", callback_data=f"d{user.id}")],
                 [
-                    InlineKeyboardButton("📤 Share Report Card", callback_data=f"sharecard_{user.id}"),
+                    InlineKeyboardButton("📤 Share Report Card", callback_data=f"s{user.id}"),
                     InlineKeyboardButton(f"⚡ {new_energy['total_remaining']} left", callback_data="energy")
                 ],
             ]
 
-            await update.message.reply_text(
+            # The placeholder becomes the result — one edit instead of delete + resend
+            await analyzing_msg.edit_text(
                 main_text, parse_mode="HTML",
                 reply_markup=InlineKeyboardMarkup(keyboard)
             )
 
-            if dex_data:
-                dex_text = format_enrichment_text(dex_data)
-                if dex_text:
-                    await update.message.reply_text(dex_text, parse_mode="HTML", disable_web_page_preview=True)
-
-            try:
-                card_bytes = generate_report_card(analysis, dex_data)
-                await update.message.reply_photo(
-                    photo=io.BytesIO(card_bytes),
-                    caption=f"🔬 <b>BERT Chart Scan</b> — {analysis.get('token', 'Unknown')} ({analysis.get('ticker', '?')})\n"
-                            f"{analysis.get('verdict', '')}\n\n"
-                            f"📤 Share this with your community!\n"
-                            f"🔗 Scan your own charts: @BertCS_bot",
-                    parse_mode="HTML"
-                )
-            except Exception as e:
-                logger.error(f"Report card generation failed: {e}")
-
-            context.user_data["last_analysis"] = analysis
-            context.user_data["last_dex_data"] = dex_data
+            card_file_id = await _send_scan_follow_ups(
+                update.message, dex_data, card_task,
+                caption=f"🔬 <b>BERT Chart Scan</b> — {analysis.get('token', 'Unknown')} ({analysis.get('ticker', '?')})\n"
+                        f"{analysis.get('verdict', '')}\n\n"
+                        f"📤 Share this with your community!\n"
+                        f"🔗 Scan your own charts: @BertCS_bot",
+            )
+
+            _remember_scan(user.id, analysis, dex_data, card_file_id)
 
         else:
             await analyzing_msg.edit_text(
@@ -338,212 +767,168 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 parse_mode="HTML"
             )
 
+    except asyncio.CancelledError:
+        # Only happens when shutdown gives up waiting; don't leave "Analyzing…" up for good
+        try:
+            await analyzing_msg.edit_text(
+                "⚠️ <b>Scan interrupted</b> — the bot is restarting. Please send the chart again.",
+                parse_mode="HTML"
+            )
+        except Exception:
+            logger.exception("Reporting scan interruption failed")
+        raise
+
     except Exception as e:
-        logger.error(f"Error analyzing chart: {e}")
-        await analyzing_msg.edit_text(
-            "❌ <b>Something went wrong!</b>\n\n"
-            "Please try again. If the issue persists, the AI service may be temporarily unavailable.\n\n"
-            "Your scan energy was <b>not consumed</b>.",
+        logger.exception("Error analyzing chart")
+        if isinstance(e, TimedOut):
+            logger.warning("Bot API pool exhausted during scan — consider raising TELEGRAM_POOL_SIZE")
+        try:
+            await analyzing_msg.edit_text(
+                "❌ <b>Something went wrong!</b>\n\n"
+                "Please try again. If the issue persists, the AI service may be temporarily unavailable.\n\n"
+                "Your scan energy was <b>not consumed</b>.",
+                parse_mode="HTML"
+            )
+        except Exception:
+            # Usually the same outage that failed the scan; don't let it escape the task
+            logger.exception("Reporting scan failure failed")
+
+
+# ═══════════════════════════════════════════
+# CALLBACK HANDLERS
+# ═══════════════════════════════════════════
+
+async def _cb_help_scan(query, context: ContextTypes.DEFAULT_TYPE):
+    await query.message.reply_text(_HELP_SCAN_TEXT, parse_mode="HTML")
+
+
+async def _cb_energy(query, context: ContextTypes.DEFAULT_TYPE):
+    energy = await _cached_energy(query.from_user.id)
+    if energy["is_premium"]:
+        await query.message.reply_text("👑 Premium — Unlimited scans!")
+    else:
+        await query.message.reply_text(
+            f"⚡ <b>Energy Status</b>\n\n"
+            f"Daily: {energy['free_remaining']}/{FREE_DAILY_SCANS}\n"
+            f"Bonus: {energy['bonus_scans']}\n"
+            f"Total: <b>{energy['total_remaining']}</b>",
             parse_mode="HTML"
         )
 
 
-async def handle_document_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    doc = update.message.document
-    if not (doc and doc.mime_type and doc.mime_type.startswith("image/")):
-        return
+async def _cb_detail(query, context: ContextTypes.DEFAULT_TYPE):
+    last_scan = _recall_scan(query.from_user.id)
+    if last_scan:
+        detail_text = format_detailed_analysis(last_scan["analysis"])
+        await query.message.reply_text(detail_text, parse_mode="HTML")
+    else:
+        await query.message.reply_text("❌ No recent analysis found. Send a new screenshot!")
 
-    user = update.effective_user
-    get_or_create_user(user.id, user.username, user.first_name)
 
-    energy = get_energy_status(user.id)
-    if energy["total_remaining"] <= 0:
-        keyboard = [
-            [InlineKeyboardButton("⚡ Buy Scans", callback_data="buy_scans")],
-            [InlineKeyboardButton("👑 Go Premium", callback_data="premium")],
-        ]
-        await update.message.reply_text("⚡ <b>Out of scans!</b>", parse_mode="HTML",
-                                         reply_markup=InlineKeyboardMarkup(keyboard))
+async def _cb_sharecard(query, context: ContextTypes.DEFAULT_TYPE):
+    last_scan = _recall_scan(query.from_user.id)
+    if not last_scan:
+        await query.message.reply_text("❌ No recent analysis found. Send a new screenshot!")
         return
 
-    analyzing_msg = await update.message.reply_text(
-        "🔬 <b>Analyzing your chart...</b>\n⏳ Please wait...", parse_mode="HTML"
-    )
-
+    analysis = last_scan["analysis"]
+    caption = (f"🔬 <b>BERT Chart Scan</b> — {analysis.get('token', 'Unknown')}\n"
+               f"📤 Forward this to share!\n🔗 @BertCS_bot")
     try:
-        file = await context.bot.get_file(doc.file_id)
-        image_data = await file.download_as_bytearray()
-        analysis = analyze_chart(bytes(image_data), doc.mime_type)
+        # Telegram already has the card from the scan — resend it by file_id.
+        # Only render and upload again if that first send failed.
+        if last_scan["card_file_id"]:
+            await query.message.reply_photo(photo=last_scan["card_file_id"], caption=caption,
+                                            parse_mode="HTML")
+        else:
+            card_bytes = await _render_card(analysis, last_scan["dex_data"])
+            sent = await _reply_card(query.message, card_bytes, caption=caption)
+            if sent.photo:
+                last_scan["card_file_id"] = sent.photo[-1].file_id
+    except Exception:
+        logger.exception("Share card failed")
+        await query.message.reply_text("❌ Failed to generate report card. Try a new scan!")
 
-        if analysis.get("success"):
-            use_scan(user.id)
-            save_scan(user.id, analysis, doc.file_id)
-            dex_data = await enrich_analysis(analysis)
-            new_energy = get_energy_status(user.id)
-            main_text = format_analysis_text(analysis)
 
-            keyboard = [
-                [InlineKeyboardButton("📝 Detailed Analysis", callback_data=f"detail_{user.id}")],
-                [
-                    InlineKeyboardButton("📤 Share Report Card", callback_data=f"sharecard_{user.id}"),
-                    InlineKeyboardButton(f"⚡ {new_energy['total_remaining']} left", callback_data="energy")
-                ],
-            ]
+async def _cb_referral(query, context: ContextTypes.DEFAULT_TYPE):
+    user = query.from_user
+    referral_code = await _remember_user(user)
+    ref_count = await asyncio.to_thread(get_referral_count, user.id)
+    ref_link = f"https://t.me/{context.bot.username}?start={referral_code}"
+    await query.message.reply_text(
+        f"🔗 <b>Your Referral Link</b>\n\n<code>{ref_link}</code>\n\n"
+        f"✅ {REFERRAL_BONUS_SCANS} free scans per referral\n👥 Referred: {ref_count}",
+        parse_mode="HTML"
+    )
 
-            await analyzing_msg.delete()
-            await update.message.reply_text(main_text, parse_mode="HTML",
-                                             reply_markup=InlineKeyboardMarkup(keyboard))
-
-            if dex_data:
-                dex_text = format_enrichment_text(dex_data)
-                if dex_text:
-                    await update.message.reply_text(dex_text, parse_mode="HTML", disable_web_page_preview=True)
-
-            try:
-                card_bytes = generate_report_card(analysis, dex_data)
-                await update.message.reply_photo(
-                    photo=io.BytesIO(card_bytes),
-                    caption=f"🔬 <b>BERT Chart Scan</b> — {analysis.get('token', 'Unknown')}\n"
-                            f"📤 Share this with your community!\n🔗 @BertCS_bot",
-                    parse_mode="HTML"
-                )
-            except Exception as e:
-                logger.error(f"Report card failed: {e}")
-
-            context.user_data["last_analysis"] = analysis
-            context.user_data["last_dex_data"] = dex_data
-        else:
-            await analyzing_msg.edit_text(
-                f"❌ {analysis.get('error', 'Analysis failed.')}", parse_mode="HTML"
-            )
-    except Exception as e:
-        logger.error(f"Error: {e}")
-        await analyzing_msg.edit_text("❌ Something went wrong. Try again.", parse_mode="HTML")
 
+async def _cb_premium(query, context: ContextTypes.DEFAULT_TYPE):
+    await _send_premium_pitch(query.message.reply_text)
 
-# ═══════════════════════════════════════════
-# CALLBACK HANDLERS
-# ═══════════════════════════════════════════
 
-async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    data = query.data
-    user = query.from_user
+async def _cb_buy_scans(query, context: ContextTypes.DEFAULT_TYPE):
+    await query.message.reply_text(_BUY_SCANS_TEXT, parse_mode="HTML", reply_markup=_BUY_SCANS_KEYBOARD)
 
-    if data == "help_scan":
-        await query.message.reply_text(
-            "📸 <b>Just send me a chart screenshot!</b>\n\n"
-            "I support charts from:\n"
-            "• DexScreener\n• TradingView\n• Birdeye\n• CoinGecko\n• Any other charting platform\n\n"
-            "📱 Screenshot → Send → Get Analysis!",
-            parse_mode="HTML"
-        )
 
-    elif data == "energy":
-        energy = get_energy_status(user.id)
-        if energy["is_premium"]:
-            await query.message.reply_text("👑 Premium — Unlimited scans!")
-        else:
-            await query.message.reply_text(
-                f"⚡ <b>Energy Status</b>\n\n"
-                f"Daily: {energy['free_remaining']}/{FREE_DAILY_SCANS}\n"
-                f"Bonus: {energy['bonus_scans']}\n"
-                f"Total: <b>{energy['total_remaining']}</b>",
-                parse_mode="HTML"
-            )
+async def _cb_pay_premium(query, context: ContextTypes.DEFAULT_TYPE):
+    await context.bot.send_invoice(
+        chat_id=query.message.chat_id,
+        title="👑 Premium Plan - 1 Month",
+        description="Unlimited chart scans, detailed analysis, priority processing, and more!",
+        payload=f"premium_{query.from_user.id}",
+        currency="XTR",
+        prices=[LabeledPrice(label="Premium (1 Month)", amount=PREMIUM_STARS_MONTHLY)],
+    )
 
-    elif data.startswith("detail_"):
-        analysis = context.user_data.get("last_analysis")
-        if analysis:
-            detail_text = format_detailed_analysis(analysis)
-            await query.message.reply_text(detail_text, parse_mode="HTML")
-        else:
-            await query.message.reply_text("❌ No recent analysis found. Send a new screenshot!")
-
-    elif data.startswith("sharecard_"):
-        analysis = context.user_data.get("last_analysis")
-        dex_data = context.user_data.get("last_dex_data")
-        if analysis:
-            try:
-                card_bytes = generate_report_card(analysis, dex_data)
-                await query.message.reply_photo(
-                    photo=io.BytesIO(card_bytes),
-                    caption=f"🔬 <b>BERT Chart Scan</b> — {analysis.get('token', 'Unknown')}\n"
-                            f"📤 Forward this to share!\n🔗 @BertCS_bot",
-                    parse_mode="HTML"
-                )
-            except Exception as e:
-                logger.error(f"Share card failed: {e}")
-                await query.message.reply_text("❌ Failed to generate report card. Try a new scan!")
-        else:
-            await query.message.reply_text("❌ No recent analysis found. Send a new screenshot!")
 
-    elif data == "referral":
-        db_user = get_or_create_user(user.id, user.username, user.first_name)
-        ref_count = get_referral_count(user.id)
-        bot_info = await context.bot.get_me()
-        ref_link = f"https://t.me/{bot_info.username}?start={db_user['referral_code']}"
-        await query.message.reply_text(
-            f"🔗 <b>Your Referral Link</b>\n\n<code>{ref_link}</code>\n\n"
-            f"✅ {REFERRAL_BONUS_SCANS} free scans per referral\n👥 Referred: {ref_count}",
-            parse_mode="HTML"
-        )
+async def _cb_pay_scans(query, context: ContextTypes.DEFAULT_TYPE):
+    await context.bot.send_invoice(
+        chat_id=query.message.chat_id,
+        title=f"⚡ {ENERGY_REFILL_STARS} Scan Refill",
+        description=f"{ENERGY_REFILL_STARS} bonus chart scans. Never expire!",
+        payload=f"scans_{query.from_user.id}_{ENERGY_REFILL_STARS}",
+        currency="XTR",
+        prices=[LabeledPrice(label=f"{ENERGY_REFILL_STARS} Scans", amount=ENERGY_REFILL_STARS)],
+    )
 
-    elif data == "premium":
-        keyboard = [[InlineKeyboardButton(
-            f"👑 Subscribe ({PREMIUM_STARS_MONTHLY} ⭐/month)", callback_data="pay_premium"
-        )]]
-        await query.message.reply_text(
-            f"👑 <b>Premium Plan</b>\n\n"
-            f"✅ <b>Unlimited</b> chart scans\n✅ Detailed analysis\n"
-            f"✅ Priority AI processing\n✅ Full history & analytics\n\n"
-            f"💰 Only <b>{PREMIUM_STARS_MONTHLY} Telegram Stars/month</b>",
-            parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard)
-        )
 
-    elif data == "buy_scans":
-        keyboard = [[InlineKeyboardButton(
-            f"⚡ Buy {ENERGY_REFILL_STARS} Scans ({ENERGY_REFILL_STARS} ⭐)", callback_data="pay_scans"
-        )]]
-        await query.message.reply_text(
-            f"⚡ <b>Refill Scans</b>\n\nGet <b>{ENERGY_REFILL_STARS} extra scans</b> "
-            f"for {ENERGY_REFILL_STARS} Telegram Stars.\nThese bonus scans don't expire!",
-            parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+async def _cb_leaderboard(query, context: ContextTypes.DEFAULT_TYPE):
+    text = await _leaderboard_text(compact=True)
+    if text is None:
+        await query.message.reply_text("🏆 No scans yet!")
+        return
+    await query.message.reply_text(text, parse_mode="HTML")
+
+
+# Exact callback_data → handler; one dict lookup instead of walking an if/elif chain
+_EXACT_HANDLERS = {
+    "help_scan": _cb_help_scan,
+    "energy": _cb_energy,
+    "referral": _cb_referral,
+    "premium": _cb_premium,
+    "buy_scans": _cb_buy_scans,
+    "pay_premium": _cb_pay_premium,
+    "pay_scans": _cb_pay_scans,
+    "leaderboard": _cb_leaderboard,
+}
+
+# Buttons that carry a suffix (the user id) are keyed by a one-char discriminator.
+# 'd'/'s' are also the first letters of the old "detail_"/"sharecard_" payloads,
+# so buttons on messages sent before the switch keep working.
+_PREFIX_HANDLERS = {
+    "d": _cb_detail,
+    "s": _cb_sharecard,
+}
 
-    elif data == "pay_premium":
-        await context.bot.send_invoice(
-            chat_id=query.message.chat_id,
-            title="👑 Premium Plan - 1 Month",
-            description="Unlimited chart scans, detailed analysis, priority processing, and more!",
-            payload=f"premium_{user.id}",
-            currency="XTR",
-            prices=[LabeledPrice(label="Premium (1 Month)", amount=PREMIUM_STARS_MONTHLY)],
-        )
 
-    elif data == "pay_scans":
-        await context.bot.send_invoice(
-            chat_id=query.message.chat_id,
-            title=f"⚡ {ENERGY_REFILL_STARS} Scan Refill",
-            description=f"{ENERGY_REFILL_STARS} bonus chart scans. Never expire!",
-            payload=f"scans_{user.id}_{ENERGY_REFILL_STARS}",
-            currency="XTR",
-            prices=[LabeledPrice(label=f"{ENERGY_REFILL_STARS} Scans", amount=ENERGY_REFILL_STARS)],
-        )
+async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    data = query.data
 
-    elif data == "leaderboard":
-        leaders = get_leaderboard(10)
-        if not leaders:
-            await query.message.reply_text("🏆 No scans yet!")
-            return
-        msg = "🏆 <b>Top Scanners</b>\n\n"
-        medals = ["🥇", "🥈", "🥉"]
-        for i, u in enumerate(leaders):
-            medal = medals[i] if i < 3 else f"{i+1}."
-            name = u["first_name"] or u["username"] or "Anon"
-            msg += f"{medal} {name} — {u['total_scans']} scans\n"
-        await query.message.reply_text(msg, parse_mode="HTML")
+    handler = _EXACT_HANDLERS.get(data) or _PREFIX_HANDLERS.get(data[:1])
+    if handler is not None:
+        await handler(query, context)
 
 
 # ═══════════════════════════════════════════
@@ -560,7 +945,8 @@ async def successful_payment_handler(update: Update, context: ContextTypes.DEFAU
     payload = payment.invoice_payload
 
     if payload.startswith("premium_"):
-        set_premium(user.id, months=1, stars_paid=payment.total_amount)
+        await asyncio.to_thread(set_premium, user.id, months=1, stars_paid=payment.total_amount)
+        _invalidate_energy(user.id)
         await update.message.reply_text(
             "👑 <b>Welcome to Premium!</b>\n\nYou now have <b>unlimited chart scans</b> for 30 days!\n"
             "Send me a screenshot to get started! 📸",
@@ -569,8 +955,9 @@ async def successful_payment_handler(update: Update, context: ContextTypes.DEFAU
     elif payload.startswith("scans_"):
         parts = payload.split("_")
         amount = int(parts[2]) if len(parts) > 2 else ENERGY_REFILL_STARS
-        add_bonus_scans(user.id, amount, stars_paid=payment.total_amount)
-        energy = get_energy_status(user.id)
+        await asyncio.to_thread(add_bonus_scans, user.id, amount, stars_paid=payment.total_amount)
+        _invalidate_energy(user.id)
+        energy = await _cached_energy(user.id)
         await update.message.reply_text(
             f"⚡ <b>Scans Refilled!</b>\n\n+{amount} bonus scans added.\n"
             f"Total available: <b>{energy['total_remaining']}</b>\n\nSend me a chart! 📸",
@@ -583,10 +970,4 @@ async def successful_payment_handler(update: Update, context: ContextTypes.DEFAU
 # ═══════════════════════════════════════════
 
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        "📸 <b>Send me a chart screenshot!</b>\n\n"
-        "I analyze images, not text. Take a screenshot of any chart "
-        "(DexScreener, TradingView, Birdeye, etc.) and send it here.\n\n"
-        "Type /help for more info.",
-        parse_mode="HTML"
-    )
+    await update.message.reply_text(_TEXT_FALLBACK, parse_mode="HTML")
@@ -7,8 +7,17 @@ import os
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
 
+# === Telegram HTTP ===
+# Scans fan out several Bot API calls at once; PTB's default pool of 1 is too small
+TELEGRAM_POOL_SIZE = 32
+TELEGRAM_POOL_TIMEOUT = 10.0
+# Handlers mostly wait on Gemini/DexScreener, so process updates in parallel
+TELEGRAM_CONCURRENT_UPDATES = 32
+
 # === Gemini Settings ===
 GEMINI_MODEL = "gemini-2.0-flash"  # Fast + vision capable
+GEMINI_MAX_CONCURRENCY = 8  # Parallel Gemini calls per process
+MAX_IMAGE_BYTES = 8 * 1024 * 1024  # Bigger uploads are rejected before reaching Gemini
 
 # === Energy System ===
 FREE_DAILY_SCANS = 3
@@ -18,9 +27,12 @@ REFERRAL_BONUS_SCANS = 5       # Scans earned per referral
 
 # === Database ===
 DATABASE_PATH = "data/bot_database.db"
+DB_POOL_SIZE = 8  # Shared SQLite connections for bot to_thread calls and API route threads
 
 # === Mini App ===
 WEBAPP_URL = os.getenv("WEBAPP_URL", "https://your-app.railway.app")
+# Register the webhook on startup; set to 0 when something else owns it
+SET_WEBHOOK = os.getenv("SET_WEBHOOK", "1") == "1"
 
 # === Branding ===
 BOT_NAME = "BERT Chart Scanner"
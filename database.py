@@ -4,117 +4,220 @@ Handles user data, scan history, energy tracking, and referrals.
 """
 import sqlite3
 import os
+import hashlib
 import json
+import queue
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from config import DATABASE_PATH, FREE_DAILY_SCANS, REFERRAL_BONUS_SCANS
+from config import DATABASE_PATH, DB_POOL_SIZE, FREE_DAILY_SCANS, REFERRAL_BONUS_SCANS
 
+try:
+    import orjson  # optional; several times faster than the stdlib encoder
 
-def get_db():
-    """Get database connection."""
-    os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
-    conn = sqlite3.connect(DATABASE_PATH)
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+except ImportError:
+    _json_dumps = json.dumps
+
+
+# Connections are opened once and reused — keeps SQLite's per-connection page
+# cache warm and skips the open + PRAGMA cost on every query.
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    # Pooled connections hop between worker threads, one borrower at a time
+    # Room for every statement this module issues, so none is ever re-parsed
+    conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False, cached_statements=256)
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA journal_mode=WAL")
+    # Durability tradeoff: under WAL, NORMAL only fsyncs at checkpoints instead of
+    # on every commit. A power loss can drop the last few scans, but the database
+    # itself can't be corrupted.
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-20000")  # ~20 MB
+    conn.execute("PRAGMA mmap_size=268435456")  # 256 MB — reads straight from the page cache
+    conn.execute("PRAGMA wal_autocheckpoint=1000")
+    conn.execute("PRAGMA busy_timeout=5000")  # wait out another writer instead of failing
     return conn
 
 
+@contextmanager
+def get_db():
+    """Borrow a connection from the pool; it goes back when the block exits."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
+                pool = queue.Queue()
+                for _ in range(DB_POOL_SIZE):
+                    pool.put(_connect())
+                _pool = pool
+    conn = _pool.get()
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()  # never hand the next borrower a half-done transaction
+        raise
+    finally:
+        _pool.put(conn)
+
+
+# Hot-path SQL, kept as constants so each call hands sqlite3 the identical string
+# and hits its per-connection statement cache
+_UPSERT_USER_SQL = """
+    INSERT INTO users (user_id, username, first_name, referral_code) VALUES (?, ?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        username = COALESCE(excluded.username, username),
+        first_name = COALESCE(excluded.first_name, first_name)
+    RETURNING *
+"""
+
+# Today's usage lives on the user row (scans_today / last_scan_date), so the
+# energy check is a single primary-key read
+_USER_SQL = "SELECT * FROM users WHERE user_id = ?"
+
+_SPEND_SCAN_SQL = """
+    UPDATE users SET
+        scans_today = ?, last_scan_date = ?,
+        bonus_scans = bonus_scans - ?, total_scans = total_scans + 1
+    WHERE user_id = ?
+"""
+
+_INSERT_SCAN_SQL = """
+    INSERT INTO scans (user_id, token, ticker, trend, action, confidence, risk_level, verdict, full_analysis, image_file_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
 def init_db():
     """Initialize database tables."""
-    conn = get_db()
-    conn.executescript("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            first_name TEXT,
-            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            is_premium INTEGER DEFAULT 0,
-            premium_until TIMESTAMP,
-            total_scans INTEGER DEFAULT 0,
-            referral_code TEXT UNIQUE,
-            referred_by INTEGER,
-            bonus_scans INTEGER DEFAULT 0
-        );
-
-        CREATE TABLE IF NOT EXISTS daily_energy (
-            user_id INTEGER,
-            date TEXT,
-            scans_used INTEGER DEFAULT 0,
-            bonus_used INTEGER DEFAULT 0,
-            PRIMARY KEY (user_id, date)
-        );
-
-        CREATE TABLE IF NOT EXISTS scans (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            token TEXT,
-            ticker TEXT,
-            trend TEXT,
-            action TEXT,
-            confidence INTEGER,
-            risk_level TEXT,
-            verdict TEXT,
-            full_analysis TEXT,
-            image_file_id TEXT,
-            FOREIGN KEY (user_id) REFERENCES users(user_id)
-        );
-
-        CREATE TABLE IF NOT EXISTS referrals (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            referrer_id INTEGER,
-            referred_id INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            bonus_awarded INTEGER DEFAULT 0
-        );
-
-        CREATE TABLE IF NOT EXISTS transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            type TEXT,
-            amount INTEGER,
-            stars_paid INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-    """)
-    conn.commit()
-    conn.close()
+    with get_db() as conn:
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                username TEXT,
+                first_name TEXT,
+                joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                is_premium INTEGER DEFAULT 0,
+                premium_until TIMESTAMP,
+                premium_until_ts INTEGER,
+                scans_today INTEGER DEFAULT 0,
+                last_scan_date TEXT,
+                total_scans INTEGER DEFAULT 0,
+                referral_code TEXT UNIQUE,
+                referred_by INTEGER,
+                bonus_scans INTEGER DEFAULT 0
+            );
+
+            CREATE TABLE IF NOT EXISTS daily_energy (
+                user_id INTEGER,
+                date TEXT,
+                scans_used INTEGER DEFAULT 0,
+                bonus_used INTEGER DEFAULT 0,
+                PRIMARY KEY (user_id, date)
+            );
+
+            CREATE TABLE IF NOT EXISTS scans (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                token TEXT,
+                ticker TEXT,
+                trend TEXT,
+                action TEXT,
+                confidence INTEGER,
+                risk_level TEXT,
+                verdict TEXT,
+                full_analysis TEXT,
+                image_file_id TEXT,
+                FOREIGN KEY (user_id) REFERENCES users(user_id)
+            );
+
+            CREATE TABLE IF NOT EXISTS referrals (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                referrer_id INTEGER,
+                referred_id INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                bonus_awarded INTEGER DEFAULT 0
+            );
+
+            CREATE TABLE IF NOT EXISTS transactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                type TEXT,
+                amount INTEGER,
+                stars_paid INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+
+            -- History pages are an index range scan + LIMIT instead of scan + sort
+            CREATE INDEX IF NOT EXISTS idx_scans_user_created ON scans(user_id, created_at DESC);
+            CREATE INDEX IF NOT EXISTS idx_referrals_referrer ON referrals(referrer_id);
+            CREATE INDEX IF NOT EXISTS idx_referrals_referred ON referrals(referred_id);
+            CREATE INDEX IF NOT EXISTS idx_users_total_scans ON users(total_scans DESC);
+        """)
+
+        # premium_until_ts mirrors premium_until as unix seconds so the energy
+        # check is an integer compare instead of an ISO parse. Backfill once.
+        columns = {r["name"] for r in conn.execute("PRAGMA table_info(users)")}
+        if "premium_until_ts" not in columns:
+            conn.execute("ALTER TABLE users ADD COLUMN premium_until_ts INTEGER")
+            conn.execute(
+                "UPDATE users SET premium_until_ts = CAST(strftime('%s', premium_until) AS INTEGER) "
+                "WHERE premium_until IS NOT NULL"
+            )
+
+        # scans_today/last_scan_date replace the daily_energy lookup. Carry over
+        # today's counts once; older daily_energy rows are kept as history.
+        if "scans_today" not in columns:
+            today = datetime.utcnow().strftime("%Y-%m-%d")
+            conn.execute("ALTER TABLE users ADD COLUMN scans_today INTEGER DEFAULT 0")
+            conn.execute("ALTER TABLE users ADD COLUMN last_scan_date TEXT")
+            conn.execute("""
+                UPDATE users SET last_scan_date = ?, scans_today = (
+                    SELECT scans_used FROM daily_energy d WHERE d.user_id = users.user_id AND d.date = ?
+                )
+                WHERE user_id IN (SELECT user_id FROM daily_energy WHERE date = ?)
+            """, (today, today, today))
+        conn.commit()
+
+
+def _scans_today(user, today: str) -> int:
+    return user["scans_today"] if user["last_scan_date"] == today else 0
+
+
+def _is_premium(user) -> bool:
+    return bool(user["is_premium"]) and (
+        user["premium_until_ts"] is None or user["premium_until_ts"] > time.time()
+    )
 
 
 def get_or_create_user(user_id: int, username: str = None, first_name: str = None) -> dict:
     """Get existing user or create new one."""
-    conn = get_db()
-    user = conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)).fetchone()
-    if not user:
-        import hashlib
-        ref_code = hashlib.md5(str(user_id).encode()).hexdigest()[:8].upper()
-        conn.execute(
-            "INSERT INTO users (user_id, username, first_name, referral_code) VALUES (?, ?, ?, ?)",
-            (user_id, username, first_name, ref_code)
-        )
+    ref_code = hashlib.md5(str(user_id).encode()).hexdigest()[:8].upper()
+    with get_db() as conn:
+        # Single upsert: no SELECT-then-INSERT race between concurrent /start updates,
+        # and the user's current name is refreshed on the way through
+        user = conn.execute(_UPSERT_USER_SQL, (user_id, username, first_name, ref_code)).fetchone()
         conn.commit()
-        user = conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)).fetchone()
-    result = dict(user)
-    conn.close()
-    return result
+        return dict(user)
 
 
 def get_energy_status(user_id: int) -> dict:
     """Get user's current energy/scan status."""
-    conn = get_db()
-    user = dict(conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)).fetchone())
     today = datetime.utcnow().strftime("%Y-%m-%d")
+    with get_db() as conn:
+        user = dict(conn.execute(_USER_SQL, (user_id,)).fetchone())
     
-    daily = conn.execute(
-        "SELECT * FROM daily_energy WHERE user_id = ? AND date = ?", (user_id, today)
-    ).fetchone()
+    scans_used_today = _scans_today(user, today)
     
-    scans_used_today = daily["scans_used"] if daily else 0
-    
-    # Check premium status
-    is_premium = user["is_premium"] and (
-        not user["premium_until"] or 
-        datetime.fromisoformat(user["premium_until"]) > datetime.utcnow()
-    )
+    is_premium = _is_premium(user)
     
     if is_premium:
         remaining = 999  # Unlimited
@@ -123,7 +226,6 @@ def get_energy_status(user_id: int) -> dict:
         bonus_remaining = user.get("bonus_scans", 0)
         remaining = base_remaining + bonus_remaining
     
-    conn.close()
     return {
         "user_id": user_id,
         "is_premium": is_premium,
@@ -137,154 +239,200 @@ def get_energy_status(user_id: int) -> dict:
 
 def use_scan(user_id: int) -> bool:
     """Consume one scan. Returns True if successful, False if no energy."""
-    energy = get_energy_status(user_id)
-    if energy["total_remaining"] <= 0:
-        return False
-    
-    conn = get_db()
     today = datetime.utcnow().strftime("%Y-%m-%d")
-    
-    if energy["free_remaining"] > 0:
-        # Use free daily scan
-        conn.execute("""
-            INSERT INTO daily_energy (user_id, date, scans_used)
-            VALUES (?, ?, 1)
-            ON CONFLICT(user_id, date) DO UPDATE SET scans_used = scans_used + 1
-        """, (user_id, today))
-    else:
-        # Use bonus scans
-        conn.execute(
-            "UPDATE users SET bonus_scans = MAX(0, bonus_scans - 1) WHERE user_id = ?",
-            (user_id,)
-        )
-    
-    conn.execute(
-        "UPDATE users SET total_scans = total_scans + 1 WHERE user_id = ?",
-        (user_id,)
-    )
-    conn.commit()
-    conn.close()
+    with get_db() as conn:
+        # Check and spend inside one write transaction — one commit, and two
+        # concurrent scans can't both spend the user's last unit of energy
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(_USER_SQL, (user_id,)).fetchone()
+        if row is None:
+            conn.rollback()
+            return False
+
+        scans_today = _scans_today(row, today)
+        if _is_premium(row) or scans_today < FREE_DAILY_SCANS:
+            # Use free daily scan
+            conn.execute(_SPEND_SCAN_SQL, (scans_today + 1, today, 0, user_id))
+        elif row["bonus_scans"] > 0:
+            # Use bonus scans
+            conn.execute(_SPEND_SCAN_SQL, (scans_today, today, 1, user_id))
+        else:
+            conn.rollback()
+            return False
+        conn.commit()
     return True
 
 
 def add_bonus_scans(user_id: int, amount: int, stars_paid: int = 0):
     """Add bonus scans to user's account."""
-    conn = get_db()
-    conn.execute(
-        "UPDATE users SET bonus_scans = bonus_scans + ? WHERE user_id = ?",
-        (amount, user_id)
-    )
-    conn.execute(
-        "INSERT INTO transactions (user_id, type, amount, stars_paid) VALUES (?, 'scan_refill', ?, ?)",
-        (user_id, amount, stars_paid)
-    )
-    conn.commit()
-    conn.close()
+    with get_db() as conn:
+        conn.execute(
+            "UPDATE users SET bonus_scans = bonus_scans + ? WHERE user_id = ?",
+            (amount, user_id)
+        )
+        conn.execute(
+            "INSERT INTO transactions (user_id, type, amount, stars_paid) VALUES (?, 'scan_refill', ?, ?)",
+            (user_id, amount, stars_paid)
+        )
+        conn.commit()
 
 
 def set_premium(user_id: int, months: int = 1, stars_paid: int = 0):
     """Set user as premium."""
-    conn = get_db()
     until = datetime.utcnow() + timedelta(days=30 * months)
-    conn.execute(
-        "UPDATE users SET is_premium = 1, premium_until = ? WHERE user_id = ?",
-        (until.isoformat(), user_id)
-    )
-    conn.execute(
-        "INSERT INTO transactions (user_id, type, amount, stars_paid) VALUES (?, 'premium', ?, ?)",
-        (user_id, months, stars_paid)
-    )
-    conn.commit()
-    conn.close()
+    until_ts = int(time.time()) + 30 * months * 86400
+    with get_db() as conn:
+        conn.execute(
+            "UPDATE users SET is_premium = 1, premium_until = ?, premium_until_ts = ? WHERE user_id = ?",
+            (until.isoformat(), until_ts, user_id)
+        )
+        conn.execute(
+            "INSERT INTO transactions (user_id, type, amount, stars_paid) VALUES (?, 'premium', ?, ?)",
+            (user_id, months, stars_paid)
+        )
+        conn.commit()
 
 
 def save_scan(user_id: int, analysis: dict, image_file_id: str = None):
     """Save a scan result to history."""
-    conn = get_db()
-    conn.execute("""
-        INSERT INTO scans (user_id, token, ticker, trend, action, confidence, risk_level, verdict, full_analysis, image_file_id)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        user_id,
-        analysis.get("token"),
-        analysis.get("ticker"),
-        analysis.get("trend"),
-        analysis.get("action"),
-        analysis.get("confidence"),
-        analysis.get("risk_level"),
-        analysis.get("verdict"),
-        json.dumps(analysis),
-        image_file_id
-    ))
-    conn.commit()
-    conn.close()
+    save_scans([(user_id, analysis, image_file_id)])
+
+
+# Called with the set of user ids after their new scans are committed, so
+# read caches elsewhere (e.g. the Mini App API) can drop stale entries.
+_scan_saved_hooks = []
+
+
+def on_scans_saved(hook):
+    _scan_saved_hooks.append(hook)
+
+
+def save_scans(scans: list[tuple[int, dict, str | None]]):
+    """Save a batch of (user_id, analysis, image_file_id) scans in one transaction."""
+    with get_db() as conn:
+        conn.executemany(_INSERT_SCAN_SQL, [
+            (
+                user_id,
+                analysis.get("token"),
+                analysis.get("ticker"),
+                analysis.get("trend"),
+                analysis.get("action"),
+                analysis.get("confidence"),
+                analysis.get("risk_level"),
+                analysis.get("verdict"),
+                _json_dumps(analysis),
+                image_file_id
+            )
+            for user_id, analysis, image_file_id in scans
+        ])
+        conn.commit()
+    if _scan_saved_hooks:
+        user_ids = {user_id for user_id, _, _ in scans}
+        for hook in _scan_saved_hooks:
+            hook(user_ids)
 
 
 def get_scan_history(user_id: int, limit: int = 20) -> list:
     """Get user's scan history."""
-    conn = get_db()
-    rows = conn.execute(
-        "SELECT * FROM scans WHERE user_id = ? ORDER BY created_at DESC LIMIT ?",
-        (user_id, limit)
-    ).fetchall()
-    result = [dict(r) for r in rows]
-    conn.close()
-    return result
+    with get_db() as conn:
+        rows = conn.execute(
+            "SELECT * FROM scans WHERE user_id = ? ORDER BY created_at DESC LIMIT ?",
+            (user_id, limit)
+        ).fetchall()
+    return [dict(r) for r in rows]
 
 
-def process_referral(referrer_code: str, new_user_id: int) -> bool:
-    """Process a referral and award bonus scans."""
-    conn = get_db()
-    referrer = conn.execute(
-        "SELECT user_id FROM users WHERE referral_code = ?", (referrer_code,)
-    ).fetchone()
-    
-    if not referrer or referrer["user_id"] == new_user_id:
-        conn.close()
-        return False
-    
-    # Check if already referred
-    existing = conn.execute(
-        "SELECT id FROM referrals WHERE referred_id = ?", (new_user_id,)
-    ).fetchone()
-    if existing:
-        conn.close()
-        return False
-    
-    conn.execute(
-        "INSERT INTO referrals (referrer_id, referred_id, bonus_awarded) VALUES (?, ?, ?)",
-        (referrer["user_id"], new_user_id, REFERRAL_BONUS_SCANS)
-    )
-    conn.execute(
-        "UPDATE users SET referred_by = ?, bonus_scans = bonus_scans + 3 WHERE user_id = ?",
-        (referrer["user_id"], new_user_id)
+# Every distribution the Mini App stats page shows, over a user's most recent
+# scans, in one round trip: (kind, value, count, avg_confidence) rows.
+_STATS_SQL = """
+    WITH recent AS (
+        SELECT token, trend, action, risk_level, confidence FROM scans
+        WHERE user_id = ? ORDER BY created_at DESC LIMIT ?
     )
-    conn.execute(
-        "UPDATE users SET bonus_scans = bonus_scans + ? WHERE user_id = ?",
-        (REFERRAL_BONUS_SCANS, referrer["user_id"])
+    SELECT 'trend', COALESCE(trend, '?'), COUNT(*), NULL FROM recent GROUP BY 2
+    UNION ALL
+    SELECT 'action', COALESCE(action, '?'), COUNT(*), NULL FROM recent GROUP BY 2
+    UNION ALL
+    SELECT 'risk', COALESCE(risk_level, '?'), COUNT(*), NULL FROM recent GROUP BY 2
+    UNION ALL
+    SELECT * FROM (
+        SELECT 'token', token, COUNT(*), NULL FROM recent
+        WHERE token IS NOT NULL AND token NOT IN ('', 'Unknown')
+        GROUP BY token ORDER BY COUNT(*) DESC LIMIT 10
     )
-    conn.commit()
-    conn.close()
+    UNION ALL
+    SELECT 'total', NULL, COUNT(*), AVG(COALESCE(confidence, 0)) FROM recent
+"""
+
+
+def get_stats_aggregates(user_id: int, limit: int = 200) -> dict:
+    """Trend/action/risk/token counts and average confidence over the user's last `limit` scans."""
+    with get_db() as conn:
+        rows = conn.execute(_STATS_SQL, (user_id, limit)).fetchall()
+    dist = {"trend": {}, "action": {}, "risk": {}, "token": {}}
+    total, avg_conf = 0, 0
+    for kind, value, count, avg in rows:
+        if kind == "total":
+            total, avg_conf = count, avg or 0
+        else:
+            dist[kind][value] = count
+    top_tokens = sorted(dist["token"].items(), key=lambda x: x[1], reverse=True)
+    return {
+        "total_scans": total,
+        "top_tokens": [{"token": t, "count": c} for t, c in top_tokens],
+        "trend_distribution": dist["trend"],
+        "action_distribution": dist["action"],
+        "risk_distribution": dist["risk"],
+        "avg_confidence": avg_conf,
+    }
+
+
+def process_referral(referrer_code: str, new_user_id: int) -> bool:
+    """Process a referral and award bonus scans."""
+    with get_db() as conn:
+        referrer = conn.execute(
+            "SELECT user_id FROM users WHERE referral_code = ?", (referrer_code,)
+        ).fetchone()
+        
+        if not referrer or referrer["user_id"] == new_user_id:
+            return False
+        
+        # Check if already referred
+        existing = conn.execute(
+            "SELECT id FROM referrals WHERE referred_id = ?", (new_user_id,)
+        ).fetchone()
+        if existing:
+            return False
+        
+        conn.execute(
+            "INSERT INTO referrals (referrer_id, referred_id, bonus_awarded) VALUES (?, ?, ?)",
+            (referrer["user_id"], new_user_id, REFERRAL_BONUS_SCANS)
+        )
+        conn.execute(
+            "UPDATE users SET referred_by = ?, bonus_scans = bonus_scans + 3 WHERE user_id = ?",
+            (referrer["user_id"], new_user_id)
+        )
+        conn.execute(
+            "UPDATE users SET bonus_scans = bonus_scans + ? WHERE user_id = ?",
+            (REFERRAL_BONUS_SCANS, referrer["user_id"])
+        )
+        conn.commit()
     return True
 
 
 def get_referral_count(user_id: int) -> int:
     """Get how many people a user has referred."""
-    conn = get_db()
-    count = conn.execute(
-        "SELECT COUNT(*) as c FROM referrals WHERE referrer_id = ?", (user_id,)
-    ).fetchone()["c"]
-    conn.close()
-    return count
+    with get_db() as conn:
+        return conn.execute(
+            "SELECT COUNT(*) as c FROM referrals WHERE referrer_id = ?", (user_id,)
+        ).fetchone()["c"]
 
 
 def get_leaderboard(limit: int = 10) -> list:
     """Get top scanners leaderboard."""
-    conn = get_db()
-    rows = conn.execute("""
-        SELECT user_id, username, first_name, total_scans
-        FROM users ORDER BY total_scans DESC LIMIT ?
-    """, (limit,)).fetchall()
-    result = [dict(r) for r in rows]
-    conn.close()
-    return result
+    with get_db() as conn:
+        rows = conn.execute("""
+            SELECT user_id, username, first_name, total_scans
+            FROM users ORDER BY total_scans DESC LIMIT ?
+        """, (limit,)).fetchall()
+    return [dict(r) for r in rows]
@@ -6,59 +6,128 @@ import aiohttp
 import asyncio
 import re
 import logging
+import time
+from bisect import bisect_right
+from collections import OrderedDict
 
 logger = logging.getLogger(__name__)
 
 DEXSCREENER_API = "https://api.dexscreener.com/latest/dex"
 DEXSCREENER_SEARCH = "https://api.dexscreener.com/latest/dex/search"
 
+# Placeholders Gemini emits when it can't read a field — never worth an API call
+_INVALID_QUERIES = frozenset({
+    "", "unknown", "n/a", "null", "none", "???", "not visible", "not visible in chart",
+})
+
+# Long alphanumeric string (31+ chars) — EVM or Solana contract address
+_ADDRESS_RE = re.compile(r'^[a-zA-Z0-9]{31,}$')
+
+CHAIN_NAMES = {
+    "solana": "Solana", "ethereum": "Ethereum", "bsc": "BSC",
+    "base": "Base", "arbitrum": "Arbitrum", "polygon": "Polygon"
+}
+
+# One keep-alive pool for every lookup — avoids a TCP + TLS handshake per scan
+_session: aiohttp.ClientSession | None = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Shared client session, created lazily inside the running event loop."""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300, keepalive_timeout=60)
+        )
+    return _session
+
+
+async def close_session():
+    """Close the shared session on shutdown so pooled sockets are released cleanly."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+# Recent search results (including "not listed"), so a token trending across many
+# users costs one API call per minute instead of one per scan
+SEARCH_CACHE_TTL = 60.0
+SEARCH_CACHE_SIZE = 2048
+_search_cache = OrderedDict()
+
+
+def _cache_search(key: str, result: dict | None):
+    _search_cache[key] = (time.monotonic(), result)
+    _search_cache.move_to_end(key)
+    while len(_search_cache) > SEARCH_CACHE_SIZE:
+        _search_cache.popitem(last=False)
+
+
+async def warmup():
+    """Open a pooled connection to DexScreener ahead of the first scan."""
+    try:
+        async with get_session().get(
+            f"{DEXSCREENER_SEARCH}?q=warmup", timeout=aiohttp.ClientTimeout(total=10)
+        ) as resp:
+            await resp.read()
+    except Exception as e:
+        logger.warning("DexScreener warmup failed: %s", e)
+
 
 async def search_token(query: str) -> dict | None:
     """
     Search DexScreener for a token by name, ticker, or contract address.
     Returns the best matching pair or None.
     """
-    if not query or query.lower() in ("unknown", "n/a", "null", "none"):
+    if not query or query.strip().lower() in _INVALID_QUERIES:
         return None
 
-    try:
-        async with aiohttp.ClientSession() as session:
-            # Check if it looks like a contract address
-            is_address = len(query) > 30 and re.match(r'^[a-zA-Z0-9]+$', query)
+    # Check if it looks like a contract address
+    is_address = _ADDRESS_RE.match(query)
 
-            if is_address:
-                url = f"{DEXSCREENER_API}/tokens/{query}"
-            else:
-                url = f"{DEXSCREENER_SEARCH}?q={query}"
+    # Addresses can be case-sensitive (base58); names and tickers aren't
+    key = query if is_address else query.strip().lower()
+    cached = _search_cache.get(key)
+    if cached and time.monotonic() - cached[0] < SEARCH_CACHE_TTL:
+        return cached[1]
 
-            async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as resp:
-                if resp.status != 200:
-                    logger.warning(f"DexScreener API returned {resp.status}")
-                    return None
+    try:
+        if is_address:
+            url = f"{DEXSCREENER_API}/tokens/{query}"
+        else:
+            url = f"{DEXSCREENER_SEARCH}?q={query}"
 
-                data = await resp.json()
-                pairs = data.get("pairs", [])
+        async with get_session().get(url, timeout=aiohttp.ClientTimeout(total=10)) as resp:
+            if resp.status != 200:
+                logger.warning("DexScreener API returned %s", resp.status)
+                return None
 
-                if not pairs:
-                    return None
+            data = await resp.json()
+            pairs = data.get("pairs", [])
 
-                # Sort by liquidity/volume to get the best pair
-                pairs.sort(
-                    key=lambda p: float(p.get("liquidity", {}).get("usd", 0) or 0),
-                    reverse=True
-                )
+            if not pairs:
+                _cache_search(key, None)
+                return None
 
-                pair = pairs[0]
-                return parse_pair_data(pair)
+            # Only the most liquid pair is used — a single max() pass, no full sort
+            pair = max(pairs, key=_pair_liquidity)
+            result = parse_pair_data(pair)
+            _cache_search(key, result)
+            return result
 
     except asyncio.TimeoutError:
         logger.warning("DexScreener API timeout")
         return None
     except Exception as e:
-        logger.error(f"DexScreener error: {e}")
+        logger.error("DexScreener error: %s", e)
         return None
 
 
+def _pair_liquidity(pair: dict) -> float:
+    return float((pair.get("liquidity") or {}).get("usd", 0) or 0)
+
+
 def parse_pair_data(pair: dict) -> dict:
     """Parse DexScreener pair data into a clean format."""
     base = pair.get("baseToken", {})
@@ -108,79 +177,73 @@ def parse_pair_data(pair: dict) -> dict:
     }
 
 
+# (threshold, divisor, suffix, format) — first row the value reaches wins
+_USD_SCALES = (
+    (1_000_000_000, 1_000_000_000, "B", ".2f"),
+    (1_000_000, 1_000_000, "M", ".2f"),
+    (1_000, 1_000, "K", ".1f"),
+    (1, 1, "", ".2f"),
+)
+_UP, _DOWN = "🟢", "🔴"
+
+# Band lookups: label i covers [THRESH[i-1], THRESH[i])
+_PRESSURE_THRESH = (35, 45, 55, 65)
+_PRESSURE_LABELS = (
+    "🔴 Strong Sell Pressure", "🔴 Slight Sell Pressure", "🟡 Balanced",
+    "🟢 Slight Buy Pressure", "🟢 Strong Buy Pressure",
+)
+_LIQ_THRESH = (10_000, 100_000, 500_000)
+_LIQ_LABELS = ("🔴 Very Low", "🟠 Low", "🟡 Medium", "🟢 High")
+
+
+def _fmt_usd(val) -> str:
+    try:
+        val = float(val)
+    except (TypeError, ValueError):
+        return "$0"
+    for threshold, divisor, suffix, spec in _USD_SCALES:
+        if val >= threshold:
+            return f"${val / divisor:{spec}}{suffix}"
+    return f"${val:.6f}"
+
+
+def _fmt_change(val) -> str:
+    try:
+        val = float(val)
+    except (TypeError, ValueError):
+        return "⚪ N/A"
+    return f"{_UP if val >= 0 else _DOWN} {val:+.1f}%"
+
+
 def format_enrichment_text(data: dict) -> str:
     """Format DexScreener data into a Telegram message section."""
     if not data or not data.get("found"):
         return ""
 
-    # Format numbers
-    def fmt_usd(val):
-        try:
-            val = float(val)
-            if val >= 1_000_000_000:
-                return f"${val/1_000_000_000:.2f}B"
-            elif val >= 1_000_000:
-                return f"${val/1_000_000:.2f}M"
-            elif val >= 1_000:
-                return f"${val/1_000:.1f}K"
-            elif val >= 1:
-                return f"${val:.2f}"
-            else:
-                return f"${val:.6f}"
-        except:
-            return "$0"
-
-    def fmt_change(val):
-        try:
-            val = float(val)
-            emoji = "🟢" if val >= 0 else "🔴"
-            return f"{emoji} {val:+.1f}%"
-        except:
-            return "⚪ N/A"
-
     # Buy pressure indicator
     buy_ratio = data.get("buy_ratio", 50)
-    if buy_ratio >= 65:
-        pressure = "🟢 Strong Buy Pressure"
-    elif buy_ratio >= 55:
-        pressure = "🟢 Slight Buy Pressure"
-    elif buy_ratio >= 45:
-        pressure = "🟡 Balanced"
-    elif buy_ratio >= 35:
-        pressure = "🔴 Slight Sell Pressure"
-    else:
-        pressure = "🔴 Strong Sell Pressure"
+    pressure = _PRESSURE_LABELS[bisect_right(_PRESSURE_THRESH, buy_ratio)]
 
     # Liquidity assessment
     liq = float(data.get("liquidity_usd", 0) or 0)
-    if liq >= 500_000:
-        liq_status = "🟢 High"
-    elif liq >= 100_000:
-        liq_status = "🟡 Medium"
-    elif liq >= 10_000:
-        liq_status = "🟠 Low"
-    else:
-        liq_status = "🔴 Very Low"
-
-    chain_name = {
-        "solana": "Solana", "ethereum": "Ethereum", "bsc": "BSC",
-        "base": "Base", "arbitrum": "Arbitrum", "polygon": "Polygon"
-    }.get(data.get("chain", ""), data.get("chain", "Unknown").title())
-
-    msg = f"""
+    liq_status = _LIQ_LABELS[bisect_right(_LIQ_THRESH, liq)]
+
+    chain_name = CHAIN_NAMES.get(data.get("chain", ""), data.get("chain", "Unknown").title())
+
+    parts = [f"""
 📡 <b>LIVE DATA</b> (DexScreener)
 ━━━━━━━━━━━━━━━━━━━━
 
-💰 <b>Price:</b> {fmt_usd(data['price_usd'])}
-📊 <b>Market Cap:</b> {fmt_usd(data.get('market_cap', 0))}
-💧 <b>Liquidity:</b> {fmt_usd(data.get('liquidity_usd', 0))} ({liq_status})
-📈 <b>24h Volume:</b> {fmt_usd(data.get('volume_24h', 0))}
+💰 <b>Price:</b> {_fmt_usd(data['price_usd'])}
+📊 <b>Market Cap:</b> {_fmt_usd(data.get('market_cap', 0))}
+💧 <b>Liquidity:</b> {_fmt_usd(data.get('liquidity_usd', 0))} ({liq_status})
+📈 <b>24h Volume:</b> {_fmt_usd(data.get('volume_24h', 0))}
 
 ━━━ PRICE CHANGES ━━━
-5m: {fmt_change(data.get('price_change_5m'))}
-1h: {fmt_change(data.get('price_change_1h'))}
-6h: {fmt_change(data.get('price_change_6h'))}
-24h: {fmt_change(data.get('price_change_24h'))}
+5m: {_fmt_change(data.get('price_change_5m'))}
+1h: {_fmt_change(data.get('price_change_1h'))}
+6h: {_fmt_change(data.get('price_change_6h'))}
+24h: {_fmt_change(data.get('price_change_24h'))}
 
 ━━━ ACTIVITY ━━━
 🔄 24h Transactions: {data.get('total_txns_24h', 0):,}
@@ -188,21 +251,21 @@ def format_enrichment_text(data: dict) -> str:
 📊 Buy Ratio: {buy_ratio}% — {pressure}
 
 ⛓ Chain: {chain_name} | DEX: {data.get('dex', 'Unknown').title()}
-"""
+"""]
 
     # Add contract address (copyable)
     ca = data.get("contract_address", "")
     if ca:
-        msg += f"\n📋 CA: <code>{ca}</code>"
+        parts.append(f"\n📋 CA: <code>{ca}</code>")
 
     # Add DexScreener link
     url = data.get("url", "")
     if url:
-        msg += f'\n🔗 <a href="{url}">View on DexScreener</a>'
+        parts.append(f'\n🔗 <a href="{url}">View on DexScreener</a>')
 
-    msg += f"\n\n━━━━━━━━━━━━━━━━━━━━"
+    parts.append("\n\n━━━━━━━━━━━━━━━━━━━━")
 
-    return msg.strip()
+    return "".join(parts).strip()
 
 
 async def enrich_analysis(analysis: dict) -> dict | None:
@@ -210,25 +273,33 @@ async def enrich_analysis(analysis: dict) -> dict | None:
     Attempt to enrich analysis with live DexScreener data.
     Tries contract address first, then token name/ticker.
     """
-    # Try contract address first
-    ca = analysis.get("contract_address")
-    if ca and ca != "null" and ca != "None" and len(str(ca)) > 10:
-        data = await search_token(str(ca))
-        if data:
-            return data
-
-    # Try ticker
-    ticker = analysis.get("ticker")
-    if ticker and ticker not in ("???", "Unknown", "N/A", "null"):
-        data = await search_token(str(ticker))
-        if data:
-            return data
-
-    # Try token name
-    token = analysis.get("token")
-    if token and token not in ("Unknown", "N/A", "null"):
-        data = await search_token(str(token))
-        if data:
-            return data
-
-    return None
+    # Try contract address first, then ticker, then token name
+    candidates = (
+        (analysis.get("contract_address"), 10),
+        (analysis.get("ticker"), 0),
+        (analysis.get("token"), 0),
+    )
+    queries = {}
+    for value, min_len in candidates:
+        if not value:
+            continue
+        query = str(value).strip()
+        key = query.lower()
+        # Skip placeholders, and the ticker/name when they're the same string
+        if len(query) > min_len and key not in _INVALID_QUERIES and key not in queries:
+            queries[key] = query
+    if not queries:
+        return None
+
+    # Fire every lookup at once, but still take the highest-priority hit: a miss on
+    # the contract address no longer costs a full extra round trip before the ticker
+    tasks = [asyncio.ensure_future(search_token(q)) for q in queries.values()]
+    try:
+        for task in tasks:
+            data = await task
+            if data:
+                return data
+        return None
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -2,19 +2,87 @@
 Dr. Inker LABS - Gemini Chart Analyzer
 Handles image analysis via Google Gemini Vision API.
 """
+import asyncio
+import io
 import json
 import re
+from concurrent.futures import ThreadPoolExecutor
 import google.generativeai as genai
-from config import GEMINI_API_KEY, GEMINI_MODEL, CHART_ANALYSIS_PROMPT
+from PIL import Image
+from config import GEMINI_API_KEY, GEMINI_MODEL, GEMINI_MAX_CONCURRENCY, CHART_ANALYSIS_PROMPT
+
+try:
+    from orjson import loads as _json_loads  # raises a json.JSONDecodeError subclass
+except ImportError:
+    _json_loads = json.loads
 
 
 # Configure Gemini
 genai.configure(api_key=GEMINI_API_KEY)
 
+# Built once — model and generation config are the same for every scan
+_MODEL = genai.GenerativeModel(
+    GEMINI_MODEL,
+    generation_config=genai.GenerationConfig(
+        temperature=0.3,  # Low temp for more consistent analysis
+        max_output_tokens=2000,
+    ),
+)
+
+TREND_EMOJI = {"Bullish": "🟢", "Bearish": "🔴", "Sideways": "🟡"}
+ACTION_EMOJI = {"BUY": "🟢", "SELL": "🔴", "HOLD": "🟡", "WAIT": "⏳"}
+RISK_EMOJI = {"LOW": "🟢", "MEDIUM": "🟡", "HIGH": "🟠", "EXTREME": "🔴"}
+
+# Confidence bars for 0..10, indexed directly
+_CONF_BARS = tuple("█" * i + "░" * (10 - i) for i in range(11))
+
+_ANALYSIS_TPL = """
+🔬 <b>DR. INKER CHART SCAN</b> 🔬
+━━━━━━━━━━━━━━━━━━━━
+
+📊 <b>{token} ({ticker})</b>
+⏱ Timeframe: {timeframe}
+📍 Platform: {platform}
+💰 Price: {current_price}
+
+━━━ TREND ━━━
+{trend_emoji} Direction: <b>{trend}</b>
+💪 Strength: {trend_strength}
+
+━━━ KEY LEVELS ━━━
+🟢 Support: {support_text}
+🔴 Resistance: {resistance_text}
+
+━━━ PATTERNS ━━━
+📐 Chart: {patterns_text}
+📊 Volume: {volume_trend}
+
+━━━ VERDICT ━━━
+{action_emoji} Action: <b>{action}</b>
+{risk_emoji} Risk: <b>{risk_level}</b>
+🎯 Confidence: [{conf_bar}] {conf}/10
+
+💬 <b>{verdict}</b>
+
+━━━━━━━━━━━━━━━━━━━━
+⚠️ <i>Not financial advice. Always DYOR.</i>
+🔬 <i>Powered by Dr. Inker LABS</i>
+""".strip()
+
+# Response clean-up patterns, compiled once
+_JSON_BLOCK_RE = re.compile(r'```(?:json)?\s*([\s\S]*?)\s*```')
+_TRAILING_COMMA_RE = re.compile(r',(\s*[}\]])')
+
 
-def analyze_chart(image_bytes: bytes, mime_type: str = "image/jpeg") -> dict:
+# The SDK's sync client runs on a dedicated, bounded pool: the event loop never
+# blocks on Google, and the pool size caps concurrent Gemini requests without
+# starving the default executor that DB and other to_thread work share.
+_gemini_pool = ThreadPoolExecutor(max_workers=GEMINI_MAX_CONCURRENCY, thread_name_prefix="gemini")
+
+
+async def analyze_chart(image_bytes: bytes | bytearray, mime_type: str = "image/jpeg") -> dict:
     """
-    Analyze a chart screenshot using Gemini Vision.
+    Analyze a chart screenshot using Gemini Vision, without blocking the event loop.
     
     Args:
         image_bytes: Raw image bytes
@@ -23,35 +91,60 @@ def analyze_chart(image_bytes: bytes, mime_type: str = "image/jpeg") -> dict:
     Returns:
         dict with analysis results
     """
-    model = genai.GenerativeModel(GEMINI_MODEL)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_gemini_pool, _analyze_chart_sync, image_bytes, mime_type)
+
+
+# Charts read just as well at this size; larger uploads only add latency
+MAX_UPLOAD_SIDE = 1600
+
+
+def _shrink_for_upload(image_bytes: bytes, mime_type: str) -> tuple[bytes, str]:
+    """Downscale oversized screenshots and re-encode as JPEG. Small images pass through untouched."""
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        if max(img.size) <= MAX_UPLOAD_SIDE:
+            return image_bytes, mime_type
+        img.thumbnail((MAX_UPLOAD_SIDE, MAX_UPLOAD_SIDE), Image.Resampling.LANCZOS)
+        buf = io.BytesIO()
+        img.convert("RGB").save(buf, format="JPEG", quality=85)
+        return buf.getvalue(), "image/jpeg"
+    except Exception:
+        return image_bytes, mime_type  # let Gemini judge anything Pillow can't read
+
+
+def _analyze_chart_sync(image_bytes: bytes | bytearray, mime_type: str = "image/jpeg") -> dict:
+    """
+    Blocking Gemini Vision call behind analyze_chart.
     
-    image_part = {
-        "mime_type": mime_type,
-        "data": image_bytes
-    }
+    Args:
+        image_bytes: Raw image bytes (a bytearray is copied here, off the caller's thread)
+        mime_type: Image MIME type
+    
+    Returns:
+        dict with analysis results
+    """
+    data, mime_type = _shrink_for_upload(bytes(image_bytes), mime_type)
+    image_part = {"mime_type": mime_type, "data": data}
     
     try:
-        response = model.generate_content(
-            [CHART_ANALYSIS_PROMPT, image_part],
-            generation_config=genai.GenerationConfig(
-                temperature=0.3,  # Low temp for more consistent analysis
-                max_output_tokens=2000,
-            )
-        )
+        response = _MODEL.generate_content([CHART_ANALYSIS_PROMPT, image_part])
         
         # Extract JSON from response
         text = response.text.strip()
         
         # Try to parse JSON (handle markdown code blocks)
-        json_match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', text)
-        if json_match:
-            text = json_match.group(1)
-        
-        # Clean up any trailing commas or issues
-        text = re.sub(r',\s*}', '}', text)
-        text = re.sub(r',\s*]', ']', text)
+        if not text.startswith("{"):
+            json_match = _JSON_BLOCK_RE.search(text)
+            if json_match:
+                text = json_match.group(1)
         
-        analysis = json.loads(text)
+        try:
+            analysis = _json_loads(text)
+        except json.JSONDecodeError:
+            # Most responses are valid JSON — only pay for the trailing-comma repair when not
+            text = _TRAILING_COMMA_RE.sub(r'\1', text)
+            analysis = _json_loads(text)
         
         # Validate required fields
         required = ["token", "trend", "action", "confidence", "risk_level", "verdict"]
@@ -86,77 +179,37 @@ def format_analysis_text(analysis: dict) -> str:
     if not analysis.get("success"):
         return f"❌ {analysis.get('error', 'Analysis failed. Try a clearer screenshot.')}"
     
-    # Trend emoji
-    trend_emoji = {
-        "Bullish": "🟢",
-        "Bearish": "🔴",
-        "Sideways": "🟡"
-    }.get(analysis.get("trend"), "⚪")
-    
-    # Action emoji
-    action_emoji = {
-        "BUY": "🟢",
-        "SELL": "🔴",
-        "HOLD": "🟡",
-        "WAIT": "⏳"
-    }.get(analysis.get("action"), "⚪")
-    
-    # Risk emoji
-    risk_emoji = {
-        "LOW": "🟢",
-        "MEDIUM": "🟡",
-        "HIGH": "🟠",
-        "EXTREME": "🔴"
-    }.get(analysis.get("risk_level"), "⚪")
-    
     # Confidence bar
     conf = analysis.get("confidence", 5)
-    conf_bar = "█" * conf + "░" * (10 - conf)
     
     # Support/Resistance levels
     supports = analysis.get("support_levels", [])
     resistances = analysis.get("resistance_levels", [])
-    support_text = " / ".join(str(s) for s in supports[:3]) if supports else "Not visible"
-    resistance_text = " / ".join(str(r) for r in resistances[:3]) if resistances else "Not visible"
     
     # Patterns
     chart_patterns = analysis.get("chart_patterns", [])
-    patterns_text = ", ".join(chart_patterns) if chart_patterns else "None detected"
     
-    # Build message
-    msg = f"""
-🔬 <b>DR. INKER CHART SCAN</b> 🔬
-━━━━━━━━━━━━━━━━━━━━
-
-📊 <b>{analysis.get('token', 'Unknown')} ({analysis.get('ticker', '???')})</b>
-⏱ Timeframe: {analysis.get('timeframe', 'N/A')}
-📍 Platform: {analysis.get('platform', 'N/A')}
-💰 Price: {analysis.get('current_price', 'N/A')}
-
-━━━ TREND ━━━
-{trend_emoji} Direction: <b>{analysis.get('trend', 'Unknown')}</b>
-💪 Strength: {analysis.get('trend_strength', 'N/A')}
-
-━━━ KEY LEVELS ━━━
-🟢 Support: {support_text}
-🔴 Resistance: {resistance_text}
-
-━━━ PATTERNS ━━━
-📐 Chart: {patterns_text}
-📊 Volume: {analysis.get('volume_trend', 'N/A')}
-
-━━━ VERDICT ━━━
-{action_emoji} Action: <b>{analysis.get('action', 'N/A')}</b>
-{risk_emoji} Risk: <b>{analysis.get('risk_level', 'N/A')}</b>
-🎯 Confidence: [{conf_bar}] {conf}/10
-
-💬 <b>{analysis.get('verdict', 'No verdict available')}</b>
-
-━━━━━━━━━━━━━━━━━━━━
-⚠️ <i>Not financial advice. Always DYOR.</i>
-🔬 <i>Powered by Dr. Inker LABS</i>
-"""
-    return msg.strip()
+    return _ANALYSIS_TPL.format_map({
+        "token": analysis.get("token", "Unknown"),
+        "ticker": analysis.get("ticker", "???"),
+        "timeframe": analysis.get("timeframe", "N/A"),
+        "platform": analysis.get("platform", "N/A"),
+        "current_price": analysis.get("current_price", "N/A"),
+        "trend_emoji": TREND_EMOJI.get(analysis.get("trend"), "⚪"),
+        "trend": analysis.get("trend", "Unknown"),
+        "trend_strength": analysis.get("trend_strength", "N/A"),
+        "support_text": " / ".join(map(str, supports[:3])) if supports else "Not visible",
+        "resistance_text": " / ".join(map(str, resistances[:3])) if resistances else "Not visible",
+        "patterns_text": ", ".join(chart_patterns) if chart_patterns else "None detected",
+        "volume_trend": analysis.get("volume_trend", "N/A"),
+        "action_emoji": ACTION_EMOJI.get(analysis.get("action"), "⚪"),
+        "action": analysis.get("action", "N/A"),
+        "risk_emoji": RISK_EMOJI.get(analysis.get("risk_level"), "⚪"),
+        "risk_level": analysis.get("risk_level", "N/A"),
+        "conf_bar": _CONF_BARS[max(0, min(10, conf))],
+        "conf": conf,
+        "verdict": analysis.get("verdict", "No verdict available"),
+    })
 
 
 def format_detailed_analysis(analysis: dict) -> str:
@@ -0,0 +1,20 @@
+"""
+Dr. Inker LABS - BERT Chart Scanner entry point
+Starts Uvicorn with the app from web_server.py.
+
+Kept import-free at module level on purpose: card render workers start from a
+fresh interpreter that re-imports the main script, and they must not pull in
+the bot, FastAPI or web_server's logging listener along with it.
+"""
+import os
+
+if __name__ == "__main__":
+    import uvicorn
+    from web_server import app
+
+    port = int(os.environ.get("PORT", 8080))
+    # Single worker: the bot, its caches, per-user scan locks and the scan write
+    # buffer all live in this process. uvicorn[standard] brings uvloop and
+    # httptools, which uvicorn picks automatically.
+    # log_config=None keeps web_server's queue-based logging.
+    uvicorn.run(app, host="0.0.0.0", port=port, log_config=None)
@@ -5,7 +5,9 @@ Creates high-quality branded visual analysis cards for social sharing.
 import io
 import os
 import logging
-from PIL import Image, ImageDraw, ImageFont
+from dataclasses import dataclass
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFont, ImageOps, features
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -14,6 +16,18 @@ LOGO_PATH = os.path.join(os.path.dirname(__file__), "static", "bert_logo.png")
 
 CARD_WIDTH = 800
 PADDING = 30
+HEADER_H = 60
+FOOTER_H = 40
+
+# Output encodings: Pillow format name + save() options.
+CARD_FORMATS = {
+    "webp": ("WEBP", {"quality": 85, "method": 4}),
+    "jpeg": ("JPEG", {"quality": 90, "progressive": True}),
+    # zlib level 1: a few times faster than the default 6 for ~20% more bytes,
+    # which is the right trade for a card that is sent once and forgotten.
+    "png": ("PNG", {"compress_level": 1}),
+}
+_HAS_WEBP = features.check("webp")
 
 # Colors
 BG_TOP = (8, 12, 21)
@@ -31,60 +45,248 @@ DARK_CARD = (16, 24, 40)
 CARD_BORDER = (30, 45, 65)
 
 
+def _first_existing(*paths):
+    return next((p for p in paths if os.path.exists(p)), None)
+
+
+_FONT_PATH_BOLD = _first_existing(
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
+)
+_FONT_PATH_REG = _first_existing(
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+)
+
+
+@lru_cache(maxsize=None)
 def get_font(size, bold=False):
-    paths = [
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf" if bold
-        else "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-        "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf" if bold
-        else "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
-    ]
-    for p in paths:
-        if os.path.exists(p):
-            return ImageFont.truetype(p, size)
+    # FreeTypeFont objects are read-only once loaded, so one per (size, bold)
+    # can be shared by every card this process renders.
+    path = _FONT_PATH_BOLD if bold else _FONT_PATH_REG
+    if path:
+        return ImageFont.truetype(path, size)
     return ImageFont.load_default()
 
 
+CATEGORY_COLORS = {
+    "trend": {"Bullish": GREEN, "Bearish": RED, "Sideways": YELLOW},
+    "action": {"BUY": GREEN, "SELL": RED, "HOLD": YELLOW, "WAIT": LIGHT_GRAY},
+    "risk": {"LOW": GREEN, "MEDIUM": YELLOW, "HIGH": ORANGE, "EXTREME": RED},
+}
+
+
 def color_for(category, value):
-    maps = {
-        "trend": {"Bullish": GREEN, "Bearish": RED, "Sideways": YELLOW},
-        "action": {"BUY": GREEN, "SELL": RED, "HOLD": YELLOW, "WAIT": LIGHT_GRAY},
-        "risk": {"LOW": GREEN, "MEDIUM": YELLOW, "HIGH": ORANGE, "EXTREME": RED},
-    }
-    return maps.get(category, {}).get(value, GRAY)
+    return CATEGORY_COLORS.get(category, {}).get(value, GRAY)
+
+
+# Pillow's built-in 256x256 black-to-white ramp (top to bottom); resizing and
+# colorizing it keeps all the gradient math in C.
+_RAMP = Image.linear_gradient("L")
+_RAMP_H = _RAMP.transpose(Image.Transpose.TRANSPOSE)
+
+
+def _colorized_ramp(ramp, size, start, end):
+    return ImageOps.colorize(ramp.resize(size, Image.BILINEAR), start, end)
+
+
+_bg_cache = {}
+
+
+def gradient_bg(height):
+    """Fresh copy of the card background for the given height."""
+    bg = _bg_cache.get(height)
+    if bg is None:
+        bg = _bg_cache[height] = _colorized_ramp(_RAMP, (CARD_WIDTH, height), BG_TOP, BG_BOT)
+    return bg.copy()
+
 
+def _load_logo(*heights):
+    """Decode the logo once and return an (RGB, alpha) pair for each requested height."""
+    src = Image.open(LOGO_PATH).convert("RGBA")
+    pairs = []
+    for h in heights:
+        logo = src.resize((int(src.width * (h / src.height)), h), Image.LANCZOS)
+        pairs.append((logo.convert("RGB"), logo.getchannel("A")))
+    return pairs
 
-def draw_gradient_bg(img):
-    draw = ImageDraw.Draw(img)
-    for y_pos in range(img.height):
-        ratio = y_pos / img.height
-        r = int(BG_TOP[0] + (BG_BOT[0] - BG_TOP[0]) * ratio)
-        g = int(BG_TOP[1] + (BG_BOT[1] - BG_TOP[1]) * ratio)
-        b = int(BG_TOP[2] + (BG_BOT[2] - BG_TOP[2]) * ratio)
-        draw.line([(0, y_pos), (CARD_WIDTH, y_pos)], fill=(r, g, b))
 
+try:
+    (_LOGO_HEADER, _LOGO_HEADER_ALPHA), (_LOGO_FOOTER, _LOGO_FOOTER_ALPHA) = _load_logo(48, 30)
+except Exception as e:
+    logger.warning("Logo unavailable, rendering cards without it: %s", e)
+    _LOGO_HEADER = _LOGO_HEADER_ALPHA = _LOGO_FOOTER = _LOGO_FOOTER_ALPHA = None
 
-def draw_accent_line(draw, y, x0, x1, thickness=2):
-    w = x1 - x0
-    for i in range(w):
-        ratio = i / w
-        r = int(ACCENT[0] + (ACCENT2[0] - ACCENT[0]) * ratio)
-        g = int(ACCENT[1] + (ACCENT2[1] - ACCENT[1]) * ratio)
-        b = int(ACCENT[2] + (ACCENT2[2] - ACCENT[2]) * ratio)
-        for t in range(thickness):
-            draw.point((x0 + i, y + t), fill=(r, g, b))
 
+# Pre-rendered pieces shared by every card this process draws
+_accent_strip_cache = {}
+_text_mask_cache = {}
+_panel_cache = {}
 
-def rr(draw, xy, radius, fill, outline=None):
-    draw.rounded_rectangle(xy, radius=radius, fill=fill, outline=outline)
 
+def _accent_strip(w, thickness):
+    strip = _accent_strip_cache.get((w, thickness))
+    if strip is None:
+        strip = _accent_strip_cache[(w, thickness)] = _colorized_ramp(
+            _RAMP_H, (w, thickness), ACCENT, ACCENT2)
+    return strip
+
+
+def _text_mask(text, font):
+    """(L mask, left, top) for text rendered once; offsets place it like draw.text would."""
+    key = (text, id(font))
+    entry = _text_mask_cache.get(key)
+    if entry is None:
+        left, top, right, bottom = font.getbbox(text)
+        mask = Image.new("L", (max(right - left, 1), max(bottom - top, 1)), 0)
+        ImageDraw.Draw(mask).text((-left, -top), text, font=font, fill=255)
+        entry = _text_mask_cache[key] = (mask, left, top)
+    return entry
+
+
+@dataclass(slots=True)
+class Canvas:
+    """The card being rendered: its image (for pastes) and draw handle (for primitives)."""
+    img: Image.Image
+    draw: ImageDraw.ImageDraw
+
+    def accent_line(self, y, x0, x1, thickness=2):
+        self.img.paste(_accent_strip(x1 - x0, thickness), (x0, y))
+
+    def cached_text(self, xy, text, font, fill):
+        """draw.text for fixed labels: rasterize each (text, font) once, then paste the mask."""
+        mask, left, top = _text_mask(text, font)
+        self.img.paste(fill, (int(xy[0]) + left, int(xy[1]) + top), mask)
+
+    def rr(self, xy, radius, fill, outline=None):
+        self.draw.rounded_rectangle(xy, radius=radius, fill=fill, outline=outline)
+
+    def panel(self, xy, radius, fill, outline=None):
+        """rr for fixed-size boxes: rasterize the rounded shape once and paste it."""
+        x0, y0, x1, y1 = xy
+        key = (x1 - x0, y1 - y0, radius, fill, outline)
+        tile = _panel_cache.get(key)
+        if tile is None:
+            # rounded_rectangle's box is inclusive, hence the +1
+            tile = Image.new("RGBA", (x1 - x0 + 1, y1 - y0 + 1), (0, 0, 0, 0))
+            ImageDraw.Draw(tile).rounded_rectangle(
+                (0, 0, x1 - x0, y1 - y0), radius=radius, fill=fill, outline=outline)
+            _panel_cache[key] = tile
+        self.img.paste(tile, (x0, y0), tile)
+
+    def badge(self, xy, w, h, accent):
+        tile = _badge_tile(w, h, accent)
+        self.img.paste(tile, xy, tile)
+
+
+@lru_cache(maxsize=None)
+def _static_width(text, font):
+    """Advance width of a string that is the same on every card."""
+    return font.getlength(text)
+
+
+@lru_cache(maxsize=None)
+def _badge_tile(w, h, accent):
+    """Signal badge background: the rounded card and its colored left bar as one tile."""
+    tile = Image.new("RGBA", (w + 1, h + 1), (0, 0, 0, 0))
+    tile_draw = ImageDraw.Draw(tile)
+    tile_draw.rounded_rectangle((0, 0, w, h), radius=10, fill=DARK_CARD, outline=CARD_BORDER)
+    tile_draw.rounded_rectangle((0, 0, 4, h), radius=2, fill=accent)
+    return tile
+
+
+def _build_header():
+    """Header band without the timestamp. It's fully opaque, so a plain RGB tile."""
+    tile = Image.new("RGB", (CARD_WIDTH, HEADER_H + 1), (12, 16, 28))
+    canvas = Canvas(tile, ImageDraw.Draw(tile))
+    canvas.accent_line(HEADER_H - 2, 0, CARD_WIDTH, 2)
+
+    lx = PADDING
+    if _LOGO_HEADER is not None:
+        tile.paste(_LOGO_HEADER, (PADDING, 6), _LOGO_HEADER_ALPHA)
+        lx = PADDING + _LOGO_HEADER.width + 10
 
-def generate_report_card(analysis: dict, dex_data: dict = None) -> bytes:
+    canvas.cached_text((lx, 10), "CHART SCANNER", get_font(24, True), ACCENT)
+    canvas.cached_text((lx, 36), "Dr. Inker LABS", get_font(10), GRAY)
+    return tile
+
+
+def _build_footer():
+    """Footer band as an RGB layer plus the alpha mask to paste it with.
+
+    The footer sits on the gradient, so it can't be opaque. Each element's
+    box is filled with its solid colour and the coverage goes into the mask,
+    which pastes exactly like drawing the elements onto the card directly.
+    """
+    rgb = Image.new("RGB", (CARD_WIDTH, FOOTER_H))
+    alpha = Image.new("L", (CARD_WIDTH, FOOTER_H), 0)
+
+    def put_text(xy, text, font, fill):
+        mask, left, top = _text_mask(text, font)
+        x, y = int(xy[0]) + left, int(xy[1]) + top
+        rgb.paste(fill, (x, y, x + mask.width, y + mask.height))
+        alpha.paste(mask, (x, y))
+
+    rgb.paste(_accent_strip(CARD_WIDTH, 2), (0, 0))
+    alpha.paste(255, (0, 0, CARD_WIDTH, 2))
+
+    f15b = get_font(15, True)
+    put_text((PADDING, 10), "Dr. Inker LABS", f15b, ACCENT)
+    put_text((PADDING + 130, 12), "•  Not financial advice  •  DYOR", get_font(10), GRAY)
+
+    handle = "@BertCS_bot"
+    hw = f15b.getlength(handle)
+    if _LOGO_FOOTER is not None:
+        flw = _LOGO_FOOTER.width
+        rgb.paste(_LOGO_FOOTER, (CARD_WIDTH - PADDING - flw, 5))
+        alpha.paste(_LOGO_FOOTER_ALPHA, (CARD_WIDTH - PADDING - flw, 5))
+        put_text((CARD_WIDTH - PADDING - flw - hw - 10, 12), handle, f15b, ACCENT2)
+    else:
+        put_text((CARD_WIDTH - PADDING - hw, 12), handle, f15b, ACCENT2)
+    return rgb, alpha
+
+
+_HEADER_TILE = _build_header()
+_FOOTER_RGB, _FOOTER_ALPHA = _build_footer()
+
+
+# DEX figures repeat a lot across cards (same hot tokens, zeroed fields), so
+# the formatted strings are memoized.
+@lru_cache(maxsize=1024)
+def _fmt_usd(val):
+    try:
+        v = float(val)
+        if v >= 1e9: return f"${v/1e9:.2f}B"
+        elif v >= 1e6: return f"${v/1e6:.2f}M"
+        elif v >= 1e3: return f"${v/1e3:.1f}K"
+        elif v >= 1: return f"${v:.2f}"
+        else: return f"${v:.6f}"
+    except (TypeError, ValueError):
+        return "$0"
+
+
+@lru_cache(maxsize=1024)
+def _fmt_pct(val):
+    try:
+        v = float(val)
+        return f"{v:+.1f}%", GREEN if v >= 0 else RED
+    except (TypeError, ValueError):
+        return "N/A", GRAY
+
+
+def generate_report_card(analysis: dict, dex_data: dict = None, fmt: str = "webp",
+                         fast: bool = False) -> bytes:
+    """Render the share card. fast=True uses a flat background instead of the gradient."""
     has_dex = dex_data and dex_data.get("found")
     height = 680 if not has_dex else 870
 
-    img = Image.new("RGB", (CARD_WIDTH, height), BG_TOP)
-    draw_gradient_bg(img)
-    draw = ImageDraw.Draw(img)
+    img = Image.new("RGB", (CARD_WIDTH, height), BG_BOT) if fast else gradient_bg(height)
+    canvas = Canvas(img, ImageDraw.Draw(img))
+    draw = canvas.draw
+    # Dynamic 10-11px labels render without antialiasing: at that size the
+    # difference is barely visible and FreeType skips the grayscale pass.
+    draw_small = ImageDraw.Draw(img)
+    draw_small.fontmode = "1"
 
     f32b = get_font(32, True)
     f24b = get_font(24, True)
@@ -97,29 +299,14 @@ def generate_report_card(analysis: dict, dex_data: dict = None) -> bytes:
 
     y = 0
 
-    # ══ HEADER ══
-    hh = 60
-    rr(draw, (0, 0, CARD_WIDTH, hh), 0, fill=(12, 16, 28))
-    draw_accent_line(draw, hh - 2, 0, CARD_WIDTH, 2)
-
-    lx = PADDING
-    try:
-        if os.path.exists(LOGO_PATH):
-            logo = Image.open(LOGO_PATH).convert("RGBA")
-            lh = 48
-            lw = int(logo.width * (lh / logo.height))
-            logo = logo.resize((lw, lh), Image.LANCZOS)
-            img.paste(logo, (PADDING, 6), logo)
-            lx = PADDING + lw + 10
-    except:
-        pass
-
-    draw.text((lx, 10), "CHART SCANNER", font=f24b, fill=ACCENT)
-    draw.text((lx, 36), "Dr. Inker LABS", font=f10, fill=GRAY)
+    # ══ HEADER ══ (static part pre-rendered; only the timestamp changes)
+    img.paste(_HEADER_TILE, (0, 0))
     ts = datetime.utcnow().strftime("%b %d, %Y  %H:%M UTC")
-    draw.text((CARD_WIDTH - PADDING - draw.textlength(ts, f11), 24), ts, font=f11, fill=GRAY)
+    # Right-aligned strings use anchor="ra" so Pillow measures them while
+    # rendering instead of in a separate textlength() pass.
+    draw_small.text((CARD_WIDTH - PADDING, 24), ts, font=f11, fill=GRAY, anchor="ra")
 
-    y = hh + 16
+    y = HEADER_H + 16
 
     # ══ TOKEN + PRICE ══
     token = analysis.get("token", "Unknown")
@@ -131,8 +318,7 @@ def generate_report_card(analysis: dict, dex_data: dict = None) -> bytes:
     draw.text((tx, y + 8), f"${ticker}", font=f18b, fill=GRAY)
 
     if price and price not in ("N/A", "null", "None"):
-        pw = draw.textlength(price, f24b)
-        draw.text((CARD_WIDTH - PADDING - pw, y + 4), price, font=f24b, fill=WHITE)
+        draw.text((CARD_WIDTH - PADDING, y + 4), price, font=f24b, fill=WHITE, anchor="ra")
     y += 44
 
     meta = []
@@ -144,7 +330,7 @@ def generate_report_card(analysis: dict, dex_data: dict = None) -> bytes:
     y += 24
 
     # ══ TREND / ACTION / RISK BADGES ══
-    draw_accent_line(draw, y, PADDING, CARD_WIDTH - PADDING, 1)
+    canvas.accent_line(y, PADDING, CARD_WIDTH - PADDING, 1)
     y += 12
 
     bw = (CARD_WIDTH - PADDING * 2 - 20) // 3
@@ -157,163 +343,162 @@ def generate_report_card(analysis: dict, dex_data: dict = None) -> bytes:
     for i, (cat, val, sub) in enumerate(badges):
         bx = PADDING + i * (bw + 10)
         c = color_for(cat, val)
-        rr(draw, (bx, y, bx + bw, y + 64), 10, fill=DARK_CARD, outline=CARD_BORDER)
-        # Colored left accent bar
-        rr(draw, (bx, y, bx + 4, y + 64), 2, fill=c)
+        canvas.badge((bx, y), bw, 64, c)
         draw.text((bx + 14, y + 10), val.upper(), font=f18b, fill=c)
-        draw.text((bx + 14, y + 38), sub, font=f11, fill=GRAY)
+        draw_small.text((bx + 14, y + 38), sub, font=f11, fill=GRAY)
     y += 80
 
     # ══ CONFIDENCE ══
     conf = min(max(analysis.get("confidence", 5), 0), 10)
     cc = GREEN if conf >= 7 else YELLOW if conf >= 4 else RED
 
-    draw.text((PADDING, y), "Confidence", font=f15b, fill=LIGHT_GRAY)
+    canvas.cached_text((PADDING, y), "Confidence", f15b, LIGHT_GRAY)
     ct = f"{conf}/10"
-    draw.text((CARD_WIDTH - PADDING - draw.textlength(ct, f15b), y), ct, font=f15b, fill=cc)
+    draw.text((CARD_WIDTH - PADDING, y), ct, font=f15b, fill=cc, anchor="ra")
     y += 22
 
     bw2 = CARD_WIDTH - PADDING * 2
-    rr(draw, (PADDING, y, PADDING + bw2, y + 8), 4, fill=(25, 35, 50))
+    canvas.rr((PADDING, y, PADDING + bw2, y + 8), 4, fill=(25, 35, 50))
     fw = max(4, int(bw2 * conf / 10))
-    rr(draw, (PADDING, y, PADDING + fw, y + 8), 4, fill=cc)
+    canvas.rr((PADDING, y, PADDING + fw, y + 8), 4, fill=cc)
     y += 20
 
     # ══ KEY LEVELS + PATTERNS (two columns) ══
-    draw_accent_line(draw, y, PADDING, CARD_WIDTH - PADDING, 1)
+    canvas.accent_line(y, PADDING, CARD_WIDTH - PADDING, 1)
     y += 10
 
     half = (CARD_WIDTH - PADDING * 2 - 16) // 2
     rx2 = PADDING + half + 16
 
     # Left column
-    draw.text((PADDING, y), "SUPPORT", font=f10, fill=GREEN)
+    canvas.cached_text((PADDING, y), "SUPPORT", f10, GREEN)
     sups = analysis.get("support_levels", [])
     draw.text((PADDING, y + 14), " / ".join(str(s) for s in sups[:3]) if sups else "—", font=f13, fill=WHITE)
 
-    draw.text((PADDING, y + 34), "RESISTANCE", font=f10, fill=RED)
+    canvas.cached_text((PADDING, y + 34), "RESISTANCE", f10, RED)
     ress = analysis.get("resistance_levels", [])
     draw.text((PADDING, y + 48), " / ".join(str(r) for r in ress[:3]) if ress else "—", font=f13, fill=WHITE)
 
     # Right column
-    draw.text((rx2, y), "PATTERNS", font=f10, fill=ACCENT2)
+    canvas.cached_text((rx2, y), "PATTERNS", f10, ACCENT2)
     pats = analysis.get("chart_patterns", [])
     draw.text((rx2, y + 14), ", ".join(pats[:3])[:40] if pats else "None", font=f13, fill=WHITE)
 
-    draw.text((rx2, y + 34), "VOLUME", font=f10, fill=ACCENT2)
+    canvas.cached_text((rx2, y + 34), "VOLUME", f10, ACCENT2)
     draw.text((rx2, y + 48), analysis.get("volume_trend", "N/A"), font=f13, fill=WHITE)
     y += 72
 
     # ══ VERDICT ══
     verdict = analysis.get("verdict", "No verdict available")
-    rr(draw, (PADDING, y, CARD_WIDTH - PADDING, y + 50), 8, fill=DARK_CARD, outline=CARD_BORDER)
+    canvas.panel((PADDING, y, CARD_WIDTH - PADDING, y + 50), 8, fill=DARK_CARD, outline=CARD_BORDER)
 
     max_w = CARD_WIDTH - PADDING * 2 - 24
-    words = verdict.split()
-    lines, line = [], ""
-    for w in words:
-        test = f"{line} {w}".strip()
-        if draw.textlength(test, f13) < max_w:
-            line = test
+    # Measure each word once and add widths up, rather than re-measuring the
+    # whole candidate line for every word. Only two lines fit the box, so stop
+    # as soon as both are full.
+    max_lines = 2
+    space_w = _static_width(" ", f13)
+    lines, line, line_w = [], [], 0.0
+    for w in verdict.split():
+        w_w = draw.textlength(w, f13)
+        test_w = line_w + space_w + w_w if line else w_w
+        if test_w < max_w:
+            line.append(w)
+            line_w = test_w
         else:
-            lines.append(line)
-            line = w
-    if line:
-        lines.append(line)
+            lines.append(" ".join(line))
+            if len(lines) == max_lines:
+                break
+            line, line_w = [w], w_w
+    if line and len(lines) < max_lines:
+        lines.append(" ".join(line))
 
     vy = y + 8
-    for l in lines[:2]:
+    for l in lines:
         draw.text((PADDING + 12, vy), l, font=f13, fill=LIGHT_GRAY)
         vy += 17
     y += 62
 
     # ══ DEXSCREENER DATA ══
     if has_dex:
-        draw_accent_line(draw, y, PADDING, CARD_WIDTH - PADDING, 1)
+        canvas.accent_line(y, PADDING, CARD_WIDTH - PADDING, 1)
         y += 10
-        draw.text((PADDING, y), "LIVE MARKET DATA", font=f15b, fill=ACCENT2)
+        canvas.cached_text((PADDING, y), "LIVE MARKET DATA", f15b, ACCENT2)
         y += 22
 
-        rr(draw, (PADDING, y, CARD_WIDTH - PADDING, y + 130), 10, fill=DARK_CARD, outline=CARD_BORDER)
+        canvas.panel((PADDING, y, CARD_WIDTH - PADDING, y + 130), 10, fill=DARK_CARD, outline=CARD_BORDER)
 
         cx = PADDING + 16
         cx2 = CARD_WIDTH // 2 + 8
 
-        def fmt(val):
-            try:
-                v = float(val)
-                if v >= 1e9: return f"${v/1e9:.2f}B"
-                elif v >= 1e6: return f"${v/1e6:.2f}M"
-                elif v >= 1e3: return f"${v/1e3:.1f}K"
-                elif v >= 1: return f"${v:.2f}"
-                else: return f"${v:.6f}"
-            except:
-                return "$0"
-
-        def pct(val):
-            try:
-                v = float(val)
-                return f"{v:+.1f}%", GREEN if v >= 0 else RED
-            except:
-                return "N/A", GRAY
-
         ry = y + 12
 
-        draw.text((cx, ry), "Price", font=f10, fill=GRAY)
-        draw.text((cx, ry + 13), fmt(dex_data.get("price_usd", 0)), font=f18b, fill=WHITE)
-        draw.text((cx2, ry), "Market Cap", font=f10, fill=GRAY)
-        draw.text((cx2, ry + 13), fmt(dex_data.get("market_cap", 0)), font=f18b, fill=WHITE)
+        canvas.cached_text((cx, ry), "Price", f10, GRAY)
+        draw.text((cx, ry + 13), _fmt_usd(dex_data.get("price_usd", 0)), font=f18b, fill=WHITE)
+        canvas.cached_text((cx2, ry), "Market Cap", f10, GRAY)
+        draw.text((cx2, ry + 13), _fmt_usd(dex_data.get("market_cap", 0)), font=f18b, fill=WHITE)
         ry += 38
 
-        draw.text((cx, ry), "Liquidity", font=f10, fill=GRAY)
-        draw.text((cx, ry + 13), fmt(dex_data.get("liquidity_usd", 0)), font=f18b, fill=WHITE)
-        draw.text((cx2, ry), "24h Volume", font=f10, fill=GRAY)
-        draw.text((cx2, ry + 13), fmt(dex_data.get("volume_24h", 0)), font=f18b, fill=WHITE)
+        canvas.cached_text((cx, ry), "Liquidity", f10, GRAY)
+        draw.text((cx, ry + 13), _fmt_usd(dex_data.get("liquidity_usd", 0)), font=f18b, fill=WHITE)
+        canvas.cached_text((cx2, ry), "24h Volume", f10, GRAY)
+        draw.text((cx2, ry + 13), _fmt_usd(dex_data.get("volume_24h", 0)), font=f18b, fill=WHITE)
         ry += 38
 
         pcx = cx
         for label, val in [("1h", dex_data.get("price_change_1h", 0)),
                            ("6h", dex_data.get("price_change_6h", 0)),
                            ("24h", dex_data.get("price_change_24h", 0))]:
-            draw.text((pcx, ry), label, font=f10, fill=GRAY)
-            txt, clr = pct(val)
+            canvas.cached_text((pcx, ry), label, f10, GRAY)
+            txt, clr = _fmt_pct(val)
             draw.text((pcx + 26, ry), txt, font=f15b, fill=clr)
             pcx += 120
 
         br = dex_data.get("buy_ratio", 50)
         brc = GREEN if br >= 50 else RED
-        draw.text((cx2 + 160, ry), "Buys", font=f10, fill=GRAY)
+        canvas.cached_text((cx2 + 160, ry), "Buys", f10, GRAY)
         draw.text((cx2 + 160, ry + 13), f"{br}%", font=f15b, fill=brc)
 
         ry += 28
         chain = dex_data.get("chain", "").title()
         dex_name = dex_data.get("dex", "").title()
-        draw.text((cx, ry), f"{chain}  •  {dex_name}", font=f11, fill=GRAY)
+        draw_small.text((cx, ry), f"{chain}  •  {dex_name}", font=f11, fill=GRAY)
 
         y += 145
 
-    # ══ FOOTER ══
-    fy = height - 40
-    draw_accent_line(draw, fy, 0, CARD_WIDTH, 2)
-
-    draw.text((PADDING, fy + 10), "Dr. Inker LABS", font=f15b, fill=ACCENT)
-    draw.text((PADDING + 130, fy + 12), "•  Not financial advice  •  DYOR", font=f10, fill=GRAY)
-
-    handle = "@BertCS_bot"
-    hw = draw.textlength(handle, f15b)
-
-    try:
-        if os.path.exists(LOGO_PATH):
-            logo = Image.open(LOGO_PATH).convert("RGBA")
-            fh = 30
-            flw = int(logo.width * (fh / logo.height))
-            logo = logo.resize((flw, fh), Image.LANCZOS)
-            img.paste(logo, (CARD_WIDTH - PADDING - flw, fy + 5), logo)
-            draw.text((CARD_WIDTH - PADDING - flw - hw - 10, fy + 12), handle, font=f15b, fill=ACCENT2)
-    except:
-        draw.text((CARD_WIDTH - PADDING - hw, fy + 12), handle, font=f15b, fill=ACCENT2)
+    # ══ FOOTER ══ (entirely static)
+    img.paste(_FOOTER_RGB, (0, height - FOOTER_H), _FOOTER_ALPHA)
 
+    if fmt == "webp" and not _HAS_WEBP:
+        fmt = "png"
+    fmt_name, save_opts = CARD_FORMATS.get(fmt, CARD_FORMATS["png"])
     buf = io.BytesIO()
-    img.save(buf, format="PNG", quality=95)
+    img.save(buf, format=fmt_name, **save_opts)
     buf.seek(0)
     return buf.getvalue()
+
+
+def warm_caches():
+    """Fill this process's font/tile/mask caches by rendering throwaway cards.
+
+    Used as the process-pool initializer so the first real card a worker
+    renders doesn't pay for loading fonts and rasterizing the static pieces.
+    """
+    try:
+        generate_report_card({})
+        generate_report_card({}, {"found": True})
+    except Exception:
+        # An initializer that raises breaks the whole pool; a cold cache doesn't.
+        logger.exception("Report card warm-up failed")
+
+
+def init_worker():
+    """Process-pool initializer: stderr logging, then warm the caches.
+
+    Workers start from a fresh interpreter (forkserver/spawn) that re-imports
+    only main.py and this module, so the root logger has no handlers until
+    this sets one up.
+    """
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    warm_caches()
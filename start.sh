@@ -1,4 +1,4 @@
 #!/bin/bash
 echo "🔬 BERT Chart Scanner - Starting..."
 mkdir -p data
-exec python web_server.py
+exec python main.py
@@ -1,51 +1,113 @@
 """
 Dr. Inker LABS - Web Server + Telegram Bot (Webhook Mode)
-Lazy-initializes bot on first request — works with gunicorn.
+FastAPI app served by Uvicorn; the bot runs on the server's own event loop.
 """
 import os
 import json
 import asyncio
+import atexit
 import logging
+import queue
 import threading
 import time
-from flask import Flask, render_template, jsonify, request, Response
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import FileResponse, JSONResponse, ORJSONResponse
+from fastapi.staticfiles import StaticFiles
 from telegram import Update
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, CallbackQueryHandler,
-    PreCheckoutQueryHandler, filters
+    PreCheckoutQueryHandler, TypeHandler, filters
+)
+from config import (
+    TELEGRAM_BOT_TOKEN, WEBAPP_URL, SET_WEBHOOK,
+    TELEGRAM_POOL_SIZE, TELEGRAM_POOL_TIMEOUT, TELEGRAM_CONCURRENT_UPDATES
 )
-from config import TELEGRAM_BOT_TOKEN, WEBAPP_URL
 from database import (
-    init_db, get_scan_history, get_energy_status, get_leaderboard, get_or_create_user
+    init_db, get_scan_history, get_energy_status, get_leaderboard,
+    get_stats_aggregates, on_scans_saved
 )
+from dexscreener import warmup as dexscreener_warmup, close_session as dexscreener_close
 from bot import (
+    ensure_user, flush_pending_scans, drain_background_tasks,
+    start_card_pool, shutdown_card_pool,
     start_command, help_command, scan_command, history_command,
     refer_command, premium_command, leaderboard_command,
     handle_photo, handle_document_image, handle_text,
     callback_handler, pre_checkout_handler, successful_payment_handler
 )
 
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO
-)
+try:
+    from orjson import dumps as _json_dumps, loads as _json_loads  # optional, faster parsing and API responses
+    _JSONResponse = ORJSONResponse
+except ImportError:
+    _JSONResponse = JSONResponse
+
+    def _reject_constant(name):
+        raise ValueError(f"{name} is not valid JSON")
+
+    def _json_loads(data):
+        # Strict like orjson: the stdlib would otherwise accept NaN/Infinity
+        return json.loads(data, parse_constant=_reject_constant)
+
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+
+# Handlers only enqueue records; a listener thread does the actual stderr write,
+# so a slow log sink never stalls the bot's event loop
+_log_queue = queue.SimpleQueue()
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+_log_listener = QueueListener(_log_queue, _log_stream)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+_log_enqueue = QueueHandler(_log_queue)
+_log_enqueue.setFormatter(logging.Formatter("%(message)s"))  # the listener adds the real prefix
+logging.basicConfig(handlers=[_log_enqueue], level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__, template_folder="templates", static_folder="static")
+_BASE_DIR = os.path.dirname(__file__)
+MINI_APP_PATH = os.path.join(_BASE_DIR, "templates", "mini_app.html")
 
-# Bot state — lazy initialized
+# Bot state — set up in the app lifespan
 _bot_app = None
-_bot_loop = None
-_initialized = False
-_init_lock = threading.Lock()
 
 
 # ═══════════════════════════════════════════
-# LAZY BOT INITIALIZATION
+# BOT LIFECYCLE
 # ═══════════════════════════════════════════
 
+async def _post_shutdown(application: Application):
+    # Runs after in-flight scans have drained: write their rows, then drop what they used
+    await flush_pending_scans()
+    await dexscreener_close()
+    shutdown_card_pool()
+
+
+# Message filters, built once and shared by every Application we build
+PHOTO = filters.PHOTO
+DOC_IMAGE = filters.Document.IMAGE
+TEXT_NON_COMMAND = filters.TEXT & ~filters.COMMAND
+SUCCESSFUL_PAYMENT = filters.SUCCESSFUL_PAYMENT
+
+# Update kinds the handlers below act on. Telegram is asked to send only
+# these; anything else that arrives is acked without building an Update.
+HANDLED_UPDATE_TYPES = ("message", "callback_query", "pre_checkout_query")
+
+
 def _build_application():
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .connection_pool_size(TELEGRAM_POOL_SIZE)
+        .pool_timeout(TELEGRAM_POOL_TIMEOUT)
+        .concurrent_updates(TELEGRAM_CONCURRENT_UPDATES)
+        .build()
+    )
+    # Group -1 runs before the handlers below, so they can assume the user row exists
+    application.add_handler(TypeHandler(Update, ensure_user), group=-1)
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("scan", scan_command))
@@ -53,183 +115,230 @@ def _build_application():
     application.add_handler(CommandHandler("refer", refer_command))
     application.add_handler(CommandHandler("premium", premium_command))
     application.add_handler(CommandHandler("leaderboard", leaderboard_command))
-    application.add_handler(MessageHandler(filters.PHOTO, handle_photo))
-    application.add_handler(MessageHandler(filters.Document.IMAGE, handle_document_image))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
+    application.add_handler(MessageHandler(PHOTO, handle_photo))
+    application.add_handler(MessageHandler(DOC_IMAGE, handle_document_image))
+    application.add_handler(MessageHandler(TEXT_NON_COMMAND, handle_text))
     application.add_handler(CallbackQueryHandler(callback_handler))
     application.add_handler(PreCheckoutQueryHandler(pre_checkout_handler))
-    application.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT, successful_payment_handler))
+    application.add_handler(MessageHandler(SUCCESSFUL_PAYMENT, successful_payment_handler))
     return application
 
 
-async def _async_init():
-    """Async init: build app, start it, set webhook."""
+async def _set_webhook(application: Application):
+    """Point Telegram at /webhook, dropping updates queued while we were down."""
+    webhook_url = f"{WEBAPP_URL}/webhook"
+    try:
+        # setWebhook takes drop_pending_updates itself; no separate deleteWebhook call
+        await asyncio.wait_for(
+            application.bot.set_webhook(
+                webhook_url, drop_pending_updates=True,
+                allowed_updates=list(HANDLED_UPDATE_TYPES)),
+            timeout=5)
+        logger.info("✅ Webhook set: %s", webhook_url)
+    except Exception as e:
+        logger.error("❌ Failed to set webhook: %s", e)
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    """Start the bot on Uvicorn's loop before serving; stop it on shutdown."""
     global _bot_app
+    logger.info("🔬 Dr. Inker Chart Scanner starting...")
+    init_db()
+    start_card_pool()
     _bot_app = _build_application()
     await _bot_app.initialize()
+    if SET_WEBHOOK and TELEGRAM_BOT_TOKEN and WEBAPP_URL:
+        await _set_webhook(_bot_app)
     await _bot_app.start()
-    logger.info("✅ Bot application initialized")
-
-
-def _run_event_loop():
-    """Run asyncio event loop in background thread."""
-    global _bot_loop
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    _bot_loop = loop
-    loop.run_forever()
-
-
-def _ensure_bot():
-    """Lazy-init bot on first request. Thread-safe."""
-    global _initialized
-    if _initialized:
-        return
-    with _init_lock:
-        if _initialized:
-            return
-        logger.info("🤖 Initializing bot (first request)...")
-
-        # Start event loop thread
-        thread = threading.Thread(target=_run_event_loop, daemon=True)
-        thread.start()
-
-        # Wait for loop to be ready
-        for _ in range(50):
-            if _bot_loop is not None:
-                break
-            time.sleep(0.1)
+    _bot_app.create_task(dexscreener_warmup())
+    logger.info("🔬 BERT Chart Scanner is live!")
+    try:
+        yield
+    finally:
+        await _bot_app.stop()
+        # No new scans start once updates stop; let running ones finish while the
+        # bot's HTTP client, the flush and the DexScreener session are still up
+        await drain_background_tasks()
+        await _bot_app.shutdown()
+        # post_shutdown hooks only fire under run_polling/run_webhook, so call it ourselves
+        await _post_shutdown(_bot_app)
 
-        # Initialize bot in the event loop
-        future = asyncio.run_coroutine_threadsafe(_async_init(), _bot_loop)
-        future.result(timeout=30)
 
-        _initialized = True
-        logger.info("🔬 BERT Chart Scanner is live!")
+app = FastAPI(lifespan=lifespan, default_response_class=_JSONResponse,
+              docs_url=None, redoc_url=None, openapi_url=None)
+app.mount("/static", StaticFiles(directory=os.path.join(_BASE_DIR, "static")), name="static")
 
 
 # ═══════════════════════════════════════════
 # WEB ROUTES
 # ═══════════════════════════════════════════
 
-@app.route("/")
-def index():
-    return jsonify({"status": "ok", "app": "BERT Chart Scanner", "mode": "webhook"})
+# Plain `def` routes call the sync database layer; FastAPI runs them in its
+# threadpool so they never block the loop the bot is running on.
+
+# The Mini App polls history/stats/leaderboard; serve repeats from memory.
+# Per-user entries are dropped as soon as that user saves a new scan.
+API_CACHE_TTL = 30.0
+API_CACHE_SIZE = 10_000
+API_CACHE_CONTROL = f"private, max-age={int(API_CACHE_TTL)}"
+_api_cache = OrderedDict()  # user_id (or None for global) -> {key: (t, value)}
+_api_cache_lock = threading.Lock()  # routes run on threadpool workers
+_api_cache_generation = 0  # bumped by every invalidation
+
+
+def _api_cached(user_id, key, compute):
+    now = time.monotonic()
+    with _api_cache_lock:
+        entries = _api_cache.get(user_id)
+        if entries:
+            hit = entries.get(key)
+            if hit and now - hit[0] < API_CACHE_TTL:
+                _api_cache.move_to_end(user_id)
+                return hit[1]
+            for stale in [k for k, (t, _) in entries.items() if now - t >= API_CACHE_TTL]:
+                del entries[stale]
+            if not entries:
+                del _api_cache[user_id]
+        generation = _api_cache_generation
+    value = compute()
+    with _api_cache_lock:
+        # A save landed while computing — the value may predate it, so serve it but don't keep it
+        if generation == _api_cache_generation:
+            _api_cache.setdefault(user_id, {})[key] = (now, value)
+            _api_cache.move_to_end(user_id)
+            while len(_api_cache) > API_CACHE_SIZE:
+                _api_cache.popitem(last=False)
+    return value
+
+
+def _invalidate_api_cache(user_ids):
+    global _api_cache_generation
+    with _api_cache_lock:
+        _api_cache_generation += 1
+        for user_id in user_ids:
+            _api_cache.pop(user_id, None)
+
+
+on_scans_saved(_invalidate_api_cache)
+
+# Health checks hit this constantly; the body never changes
+_INDEX_BODY = _json_dumps({"status": "ok", "app": "BERT Chart Scanner", "mode": "webhook"})
+
+
+@app.get("/")
+async def index():
+    return Response(_INDEX_BODY, media_type="application/json")
+
+
+@app.get("/app")
+def mini_app():
+    # The page reads user_id from its own query string
+    return FileResponse(MINI_APP_PATH, media_type="text/html")
 
 
-@app.route("/app")
-def mini_app():
-    user_id = request.args.get("user_id", "0")
-    return render_template("mini_app.html", user_id=user_id)
+HISTORY_MAX_LIMIT = 100
+
+
+@app.get("/api/history/{user_id}")
+def api_history(user_id: int, limit: int = 50):
+    # One cached row list per user at the max limit; each request takes its slice
+    limit = min(max(limit, 1), HISTORY_MAX_LIMIT)
+    rows = _api_cached(user_id, "history", lambda: _history_rows(user_id))
+    body = b'{"scans":[' + b",".join(rows[:limit]) + b"]}"
+    return Response(body, media_type="application/json",
+                    headers={"Cache-Control": API_CACHE_CONTROL})
 
 
-@app.route("/api/history/<int:user_id>")
-def api_history(user_id):
-    limit = request.args.get("limit", 50, type=int)
-    scans = get_scan_history(user_id, limit=limit)
-    for scan in scans:
-        if scan.get("full_analysis"):
+def _history_rows(user_id: int) -> list:
+    """Encoded scan rows, newest first, with each stored full_analysis spliced in as-is.
+
+    full_analysis is already JSON text (written by save_scans), so it is only
+    checked, not re-encoded. Empty or non-strict text (NaN from older writes)
+    comes out as null rather than breaking the whole response.
+    """
+    rows = []
+    for scan in get_scan_history(user_id, limit=HISTORY_MAX_LIMIT):
+        analysis = scan.pop("full_analysis", None)
+        if analysis:
             try:
-                scan["full_analysis"] = json.loads(scan["full_analysis"])
-            except:
-                pass
-    return jsonify({"scans": scans})
-
-
-@app.route("/api/energy/<int:user_id>")
-def api_energy(user_id):
-    return jsonify(get_energy_status(user_id))
-
-
-@app.route("/api/leaderboard")
-def api_leaderboard():
-    return jsonify({"leaderboard": get_leaderboard(20)})
-
-
-@app.route("/api/stats/<int:user_id>")
-def api_stats(user_id):
-    scans = get_scan_history(user_id, limit=200)
-    if not scans:
-        return jsonify({
-            "total_scans": 0, "top_tokens": [],
-            "trend_distribution": {}, "action_distribution": {}, "risk_distribution": {}
-        })
-    trends, actions, risks, tokens = {}, {}, {}, {}
-    for scan in scans:
-        trends[scan.get("trend", "?")] = trends.get(scan.get("trend", "?"), 0) + 1
-        actions[scan.get("action", "?")] = actions.get(scan.get("action", "?"), 0) + 1
-        risks[scan.get("risk_level", "?")] = risks.get(scan.get("risk_level", "?"), 0) + 1
-        tk = scan.get("token", "Unknown")
-        if tk and tk != "Unknown":
-            tokens[tk] = tokens.get(tk, 0) + 1
-    top_tokens = sorted(tokens.items(), key=lambda x: x[1], reverse=True)[:10]
-    return jsonify({
-        "total_scans": len(scans),
-        "top_tokens": [{"token": t, "count": c} for t, c in top_tokens],
-        "trend_distribution": trends, "action_distribution": actions,
-        "risk_distribution": risks,
-        "avg_confidence": sum(s.get("confidence", 0) or 0 for s in scans) / len(scans) if scans else 0
-    })
+                _json_loads(analysis)
+            except ValueError:
+                logger.warning("Scan %s has invalid full_analysis JSON", scan.get("id"))
+                analysis = None
+        if analysis:
+            row = _json_dumps(scan)
+            row = b"%s,\"full_analysis\":%s}" % (row[:-1], analysis.encode())
+        else:
+            scan["full_analysis"] = None
+            row = _json_dumps(scan)
+        rows.append(row)
+    return rows
 
 
-# ═══════════════════════════════════════════
-# TELEGRAM WEBHOOK ENDPOINT
-# ═══════════════════════════════════════════
+@app.get("/api/energy/{user_id}")
+def api_energy(user_id: int):
+    return get_energy_status(user_id)
 
-@app.route("/webhook", methods=["POST"])
-def telegram_webhook():
-    """Receive Telegram updates via webhook."""
-    _ensure_bot()
 
-    if _bot_app is None or _bot_loop is None:
-        logger.error("❌ Bot not ready after init!")
-        return Response("Bot not ready", status=503)
+@app.get("/api/leaderboard")
+def api_leaderboard(response: Response):
+    response.headers["Cache-Control"] = API_CACHE_CONTROL
+    return _api_cached(None, "leaderboard", lambda: {"leaderboard": get_leaderboard(20)})
 
-    try:
-        data = request.get_json(force=True)
-        logger.info(f"📨 Webhook update: {data.get('update_id', '?')}")
-        update = Update.de_json(data, _bot_app.bot)
-        future = asyncio.run_coroutine_threadsafe(
-            _bot_app.process_update(update), _bot_loop
-        )
-        future.result(timeout=60)
-        return Response("ok", status=200)
-    except Exception as e:
-        logger.error(f"Webhook error: {e}", exc_info=True)
-        return Response("ok", status=200)
+
+@app.get("/api/stats/{user_id}")
+def api_stats(user_id: int, response: Response):
+    response.headers["Cache-Control"] = API_CACHE_CONTROL
+    return _api_cached(user_id, "stats", lambda: get_stats_aggregates(user_id))
 
 
 # ═══════════════════════════════════════════
-# STARTUP — only init DB at module level
+# TELEGRAM WEBHOOK ENDPOINT
 # ═══════════════════════════════════════════
 
-logger.info("🔬 Dr. Inker Chart Scanner starting...")
-init_db()
+# Telegram updates are a few KB; anything near this is not from Telegram
+WEBHOOK_MAX_BODY = 1 << 20
+
+
+async def _read_body(request: Request, limit: int) -> bytes | None:
+    """Request body, or None once it exceeds `limit` bytes (stops reading there)."""
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > limit:
+        return None
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            return None
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+@app.post("/webhook")
+async def telegram_webhook(request: Request):
+    """Receive Telegram updates via webhook.
+
+    Acks as soon as the update is queued. The running Application consumes
+    update_queue itself (honouring concurrent_updates), so handlers — Gemini
+    calls, card renders — never hold up the response.
+    """
+    if _bot_app is None:
+        logger.error("❌ Bot not ready!")
+        return Response("Bot not ready", status_code=503)
+
+    body = await _read_body(request, WEBHOOK_MAX_BODY)
+    if body is None:
+        logger.warning("Rejected oversized webhook body")
+        return Response("Payload too large", status_code=413)
 
-# Set webhook at startup (raw API, no bot app needed)
-if TELEGRAM_BOT_TOKEN and WEBAPP_URL:
     try:
-        import urllib.request as _urlreq
-        webhook_url = f"{WEBAPP_URL}/webhook"
-
-        _data = json.dumps({"drop_pending_updates": True}).encode("utf-8")
-        _req = _urlreq.Request(
-            f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/deleteWebhook",
-            data=_data, headers={"Content-Type": "application/json"})
-        _urlreq.urlopen(_req, timeout=10)
-
-        _data = json.dumps({"url": webhook_url}).encode("utf-8")
-        _req = _urlreq.Request(
-            f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/setWebhook",
-            data=_data, headers={"Content-Type": "application/json"})
-        _resp = _urlreq.urlopen(_req, timeout=10)
-        _result = json.loads(_resp.read().decode())
-        logger.info(f"✅ Webhook set: {webhook_url} — {_result}")
+        data = _json_loads(body)
+        logger.info("📨 Webhook update: %s", data.get("update_id", "?"))
+        if not any(kind in data for kind in HANDLED_UPDATE_TYPES):
+            return Response("ok", status_code=200)
+        update = Update.de_json(data, _bot_app.bot)
+        _bot_app.update_queue.put_nowait(update)
     except Exception as e:
-        logger.error(f"❌ Failed to set webhook: {e}")
-# Bot app init happens lazily on first webhook request
-
-
-if __name__ == "__main__":
-    port = int(os.environ.get("PORT", 8080))
-    app.run(host="0.0.0.0", port=port, debug=False, threaded=True)
+        logger.exception("Webhook error: %s", e)
+    return Response("ok", status_code=200)